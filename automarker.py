@@ -1,22 +1,78 @@
-# automarker 0.2.2
+# automarker 0.3.0
 # Copyright (c) 2018 Ministry of Education, Singapore
 # moe_cpdd_computing_education@moe.edu.sg
 
 # Version History:
+# 0.3.0
+# - Test cases are run in parallel across multiple processes
+# - Test cases can be run in a separate process with a time limit
+# - Faster input() and print() in programs being tested
+# - Less setup for each test case run
+# - Compiled submissions are cached on disk between runs
+# - Test case results are cached on disk, so only new or changed test cases
+#   and submissions are run again
+# - Reports are written as submissions are marked, using less memory
+# - Tables in reports are written a row at a time
+# - Faster column width computation and wrapping in report tables
+# - Command line mode that runs without the GUI (run with --help for usage)
+# - GUI stays responsive while marking, shows progress and can cancel marking
+# - Option to stop a program as soon as its output differs from the expected
+#   output
+# - Programs that print too much output are stopped, so marking memory stays
+#   bounded
+# - Results can also be saved as JSON Lines and as a CSV score sheet
+# - Test case files are scanned once without loading them into memory, and
+#   test cases are read from the file when needed
+# - A test case's input or expected output can be taken from another file by
+#   adding [file: name] to its header line
+# - Faster search for submissions, which only lists folders that have changed
+#   since the last search
+# - Watch mode that re-marks submissions as they are added or changed and
+#   keeps the report up to date, and re-marks them all when the test case
+#   file changes
+# - Identical submissions are only marked once and are listed in the report
+# - Option to also mark submissions that only differ in comments, formatting
+#   or docstrings once
+# - Test cases are timed, and the report can show times, peak memory and the
+#   slowest submissions and test cases
+# - Submissions can be compared with a reference solution by time or by lines
+#   run, and those that cost much more are listed in the report
+# - Optional limit on the lines each test case may run, which stops runaway
+#   programs at the same point on any computer
+# - Processes that run programs with a time limit are replaced after a number
+#   of submissions or once they use too much memory, and can have a memory
+#   limit
 # 0.2.2
 # - Fixed unexpected behaviour when program with syntax error is encountered
 
-import tkinter as tk
-from tkinter import ttk
-from tkinter import filedialog as fd
-from tkinter import simpledialog as sd
-from tkinter import messagebox as mb
-from tkinter import scrolledtext as st
-from unittest import mock
 from functools import reduce
+import functools
+import copy
+import ast
+import contextlib
 from os import path
+import concurrent.futures
+import multiprocessing
+import importlib.util
 import textwrap as tw
-import glob
+import argparse
+import threading
+import builtins
+import queue
+import time
+import tempfile
+import locale
+import codecs
+import hashlib
+import marshal
+import tracemalloc
+import heapq
+import mmap
+import shutil
+import fnmatch
+import json
+import sys
+import csv
 import io
 import re
 import os
@@ -31,9 +87,34 @@ BASE_SCOPE = {
     '__cached__': None
 }
 
+# Builtins of programs being tested. This is taken once when the automarker
+# starts and each run gets a flat copy of it, so a program that changes its
+# __builtins__ cannot affect the automarker or any other run.
+BASE_BUILTINS = builtins.__dict__.copy()
+
 DEFAULT_PREFIX = '###'
 DEFAULT_FILE_FILTER = '*.py'
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_TIMEOUT = 10
+DEFAULT_OUTPUT_LIMIT = 1024 * 1024
+DEFAULT_RECYCLE_AFTER = 100
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_EFFICIENCY_FACTOR = 2
 VALID_FILE_FILTER_REGEX = r'[\w\-.*?]+\.py'
+
+if os.name == 'nt':
+    CACHE_BASE_FOLDER = os.environ.get('LOCALAPPDATA') or path.expanduser('~')
+elif sys.platform == 'darwin':
+    CACHE_BASE_FOLDER = path.expanduser('~/Library/Caches')
+else:
+    CACHE_BASE_FOLDER = os.environ.get('XDG_CACHE_HOME') or path.expanduser('~/.cache')
+DEFAULT_CACHE_FOLDER = path.join(CACHE_BASE_FOLDER, 'automarker')
+
+# Part of the key of every cached test result. Increase it whenever the format
+# of cached results or how programs are run and checked changes, so that
+# results from older versions are not reused.
+RESULT_CACHE_VERSION = 2
+
 PADX = 6
 PADY = 6
 READONLY_BG = 'light gray'
@@ -47,7 +128,11 @@ INSTRUCTIONS = '''This automarker automatically runs test cases on multiple Pyth
 
 Test cases must be stored in a text file with a .txt extension. Each test case has an input section followed by an output section. Each section must begin with a header line that starts with a configurable prefix ({0} by default). The header line is only used to detect the start of a section and is otherwise ignored. The text file can contain multiple test cases by alternating between input and output sections.
 
-For a test case, each line in the input section corresponds to a line of text that the automarker will provide when the input() function is encountered. Similarly, each line in the output section corresponds to a line of text that the program is expected to generate using the print() function. The test case is failed if the actual output generated by the program does not match the expected output exactly.'''.format(DEFAULT_PREFIX)
+A section can instead be taken from another file by adding [file: name] to its header line, where name is relative to the folder of the test cases file. The lines of the section itself are then ignored.
+
+For a test case, each line in the input section corresponds to a line of text that the automarker will provide when the input() function is encountered. Similarly, each line in the output section corresponds to a line of text that the program is expected to generate using the print() function. The test case is failed if the actual output generated by the program does not match the expected output exactly.
+
+Each test case has a time limit of {1} seconds. Programs that run for longer are stopped and the test case is reported as timed out (T). Programs that print more than {2} MB of output (or much more than the expected output, if that is larger) are also stopped and the test case is reported as exceeding the output limit (L). When the automarker is run from the command line with --line-limit, programs that run more than that many lines (each pass of a loop counts) are stopped too and the test case is reported as exceeding the line limit (X).'''.format(DEFAULT_PREFIX, DEFAULT_TIMEOUT, DEFAULT_OUTPUT_LIMIT // (1024 * 1024))
 
 EXAMPLE = '''The .txt file on the left has 3 test cases for an integer addition problem. Using this file, the automarker will simulate 3 test runs for each Python program. On the right, you can see the 3 simulated test runs for a program that passes 2 out of the 3 test cases.'''
 
@@ -89,6 +174,86 @@ SUBMISSIONS_STATUS_NONE = 'No submissions found'
 
 REPORT_STATUS = 'Ready to run {0} test case(s) on {1} submission(s)'
 REPORT_STATUS_NONE = 'Not ready'
+REPORT_CACHE_STATUS = 'Reused {0} cached result(s) and ran {1} test case(s)'
+REPORT_SUMMARY = '{0} out of {1} submissions passed all test cases.'
+REPORT_CANCELLED = 'Marking was cancelled after {0} out of {1} submission(s)'
+REPORT_PROGRESS = 'Marked {0}/{1} submission(s) and {2}/{3} test case(s), {4:.1f} test case(s)/s, about {5} left'
+REPORT_PROGRESS_CANCELLING = 'Cancelling...'
+REPORT_PROGRESS_INTERVAL = 100
+REPORT_IDENTICAL = 'Identical submissions'
+REPORT_SLOWEST_SUBMISSIONS = 'Slowest submissions'
+REPORT_SLOWEST_TEST_CASES = 'Slowest test cases'
+
+# Number of submissions and test cases in the slowest lists of the report
+REPORT_SLOWEST = 10
+REPORT_SHARED = 'Shared the results of {0} test case run(s) between identical or equivalent submissions'
+REPORT_WATCHING = 'Watching for changes. Updated at {0}: {1} out of {2} submissions passed all test cases.'
+REPORT_WATCH_MARKED = '{0}: re-marked {1} and removed {2} submission(s). {3} out of {4} submissions passed all test cases.'
+REPORT_WATCH_ERROR = 'Watching for changes. {0}: {1}'
+
+REPORT_EFFICIENCY = 'Compared the {0} of each submission with {1}: {2} submission(s) cost more than {3} times as much or were stopped by a limit.'
+REPORT_REFERENCE_FAILED = 'The reference solution failed test case(s) {0}, which were not compared.'
+REPORT_INEFFICIENT = 'Less efficient than the reference solution'
+
+# Seconds between checks for changed submissions in watch mode
+WATCH_INTERVAL = 1
+
+PASSED = 'Passed'
+FAILED = 'Failed'
+TIMED_OUT = 'Timed out'
+OUTPUT_LIMIT_EXCEEDED = 'Output limit exceeded'
+LINE_LIMIT_EXCEEDED = 'Line limit exceeded'
+
+# Costs that submissions can be compared with the reference solution by
+COST_TIME = 'time'
+COST_LINES = 'lines'
+COST_NAMES = {
+    COST_TIME: 'wall time',
+    COST_LINES: 'lines run'
+}
+
+# Characters of output kept after the first difference from the expected
+# output when programs are stopped there
+MISMATCH_CONTEXT = 200
+MISMATCH_NOTE = '\n[Stopped at the first difference from the expected output]'
+
+# Characters of output kept when a program exceeds the output limit
+OUTPUT_LIMIT_HEAD = 2000
+
+# Bytes allowed past the expected output of a test case, when that is larger
+# than the output limit, for differences such as line endings
+OUTPUT_LIMIT_MARGIN = 4096
+
+# Characters of test case input and expected output kept in memory for a run,
+# so that each test case is read and decoded once rather than for every
+# submission
+SECTION_CACHE_SIZE = 64 * 1024 * 1024
+OUTPUT_LIMIT_NOTE = '\n[Stopped after printing {0} bytes, more than the limit of {1} bytes]'
+LINE_LIMIT_NOTE = '\n[Stopped after running more than the limit of {0} lines]'
+
+# Lines run are counted as the number of times a program moves on to a new
+# line plus the number of times it jumps back to repeat a loop, so that every
+# pass of a loop counts even if the loop is on one line. They are counted
+# with sys.monitoring where there is one (Python 3.12 and later), which only
+# calls back for the program being tested, and otherwise with sys.settrace()
+# and an event for every bytecode. Counts are the same on any computer and
+# close between Python versions, which compile loops differently (see
+# bench_counts() in benchmark.py). Counting makes CPU-bound programs about 15
+# times slower with sys.monitoring and about 65 times slower with
+# sys.settrace() on Python 3.11 (see bench_lines()).
+LINE_MONITORING = hasattr(sys, 'monitoring')
+
+# Characters of each output kept in JSON Lines exports
+EXPORT_OUTPUT_LIMIT = 1000
+
+# How each test result status is shown in the report summary table
+STATUS_MARKS = {
+    PASSED: 1,
+    FAILED: 0,
+    TIMED_OUT: 'T',
+    OUTPUT_LIMIT_EXCEEDED: 'L',
+    LINE_LIMIT_EXCEEDED: 'X'
+}
 
 # The following module code is adapted from https://github.com/foutaise/texttable/ under the MIT license.
 # Copyright (C) 2003-2018 Gerome Fournier <jef(at)foutaise.org>
@@ -111,6 +276,26 @@ class FallbackToText(Exception):
     pass
 
 
+# Characters that textwrap turns into spaces or uses as word separators,
+# other than spaces and newlines
+WRAP_WHITESPACE_REGEX = re.compile('[\t\x0b\x0c\r]')
+
+
+@functools.lru_cache(maxsize=4096)
+def _wrap(line, width):
+    """Wrap a line of a cell to the desired width
+
+    Report tables repeat the same test case inputs and outputs for many
+    submissions, so wrapped lines are cached. A line that already fits and
+    would not be changed by textwrap is returned as it is.
+    """
+
+    if (len(line) <= width and not line[-1].isspace()
+            and not WRAP_WHITESPACE_REGEX.search(line)):
+        return (line,)
+    return tuple(tw.wrap(line, width))
+
+
 class Texttable:
 
     BORDER = 1
@@ -143,6 +328,8 @@ class Texttable:
         self._row_size = None
         self._header = []
         self._rows = []
+        self._header_width = []
+        self._rows_width = []
         return self
 
     def set_max_width(self, max_width):
@@ -293,6 +480,7 @@ class Texttable:
 
         self._check_row_size(array)
         self._header = list(map(str, array))
+        self._header_width = [self._len_cell(x) for x in self._header]
         return self
 
     def add_row(self, array):
@@ -310,6 +498,15 @@ class Texttable:
         for i, x in enumerate(array):
             cells.append(self._str(i, x))
         self._rows.append(cells)
+        # Keep the widest cell of each column, so that drawing does not need
+        # to measure every cell again
+        widths = self._rows_width
+        for i, cell in enumerate(cells):
+            width = self._len_cell(cell)
+            if i == len(widths):
+                widths.append(width)
+            elif width > widths[i]:
+                widths[i] = width
         return self
 
     def add_rows(self, rows, header=True):
@@ -339,26 +536,44 @@ class Texttable:
         - the table is returned as a whole string
         """
 
+        if not self._header and not self._rows:
+            return
+        return "".join(self.draw_rows())[:-1]
+
+    def draw_to(self, f):
+        """Draw the table into a writable file object
+
+        - the output is the same as draw(), followed by a newline
+        """
+
+        for out in self.draw_rows():
+            f.write(out)
+
+    def draw_rows(self):
+        """Draw the table one row at a time
+
+        - each row (or line between rows) is yielded as a string that ends
+          with a newline
+        """
+
         if not self._header and not self._rows:
             return
         self._compute_cols_width()
         self._check_align()
-        out = ""
         if self._has_border():
-            out += self._hline()
+            yield self._hline()
         if self._header:
-            out += self._draw_line(self._header, isheader=True)
+            yield self._draw_line(self._header, isheader=True)
             if self._has_header():
-                out += self._hline_header()
+                yield self._hline_header()
         length = 0
         for row in self._rows:
             length += 1
-            out += self._draw_line(row)
+            yield self._draw_line(row)
             if self._has_hlines() and length < len(self._rows):
-                out += self._hline()
+                yield self._hline()
         if self._has_border():
-            out += self._hline()
-        return out[:-1]
+            yield self._hline()
 
     @classmethod
     def _to_float(cls, x):
@@ -518,6 +733,8 @@ class Texttable:
         cell, such like newlines and tabs
         """
 
+        if '\t' not in cell:
+            return max(map(len, cell.split('\n')))
         cell_lines = cell.split('\n')
         maxi = 0
         for line in cell_lines:
@@ -540,15 +757,12 @@ class Texttable:
 
         if hasattr(self, "_width"):
             return
-        maxi = []
-        if self._header:
-            maxi = [self._len_cell(x) for x in self._header]
-        for row in self._rows:
-            for cell, i in zip(row, list(range(len(row)))):
-                try:
-                    maxi[i] = max(maxi[i], self._len_cell(cell))
-                except (TypeError, IndexError):
-                    maxi.append(self._len_cell(cell))
+        maxi = list(self._header_width)
+        for i, width in enumerate(self._rows_width):
+            if i < len(maxi):
+                maxi[i] = max(maxi[i], width)
+            else:
+                maxi.append(width)
 
         ncols = len(maxi)
         content_width = sum(maxi)
@@ -560,13 +774,26 @@ class Texttable:
             if self._max_width < (ncols + deco_width):
                 raise ValueError('max_width too low to render data')
             available_width = self._max_width - deco_width
-            newmaxi = [0] * ncols
-            i = 0
-            while available_width > 0:
-                if newmaxi[i] < maxi[i]:
+            # Same as handing out one character at a time to each column in
+            # turn, skipping columns that are already wide enough: find the
+            # width every column gets in full rounds, then give what is left
+            # to the first columns that can take it
+            level = used = 0
+            for k, width in enumerate(sorted(maxi)):
+                cost = (width - level) * (ncols - k)
+                if used + cost > available_width:
+                    level += (available_width - used) // (ncols - k)
+                    break
+                used += cost
+                level = width
+            newmaxi = [min(width, level) for width in maxi]
+            remaining = available_width - sum(newmaxi)
+            for i in range(ncols):
+                if remaining <= 0:
+                    break
+                if maxi[i] > level:
                     newmaxi[i] += 1
-                    available_width -= 1
-                i = (i + 1) % ncols
+                    remaining -= 1
             maxi = newmaxi
         self._width = maxi
 
@@ -589,29 +816,25 @@ class Texttable:
 
         line = self._splitit(line, isheader)
         space = " "
-        out = ""
+        separator = " %s " % [space, self._char_vert][self._has_vlines()]
+        start = ["", "%s " % self._char_vert][self._has_border()]
+        end = "%s\n" % ['', space + self._char_vert][self._has_border()]
+        aligns = self._header_align if isheader else self._align
+        out = []
         for i in range(len(line[0])):
-            if self._has_border():
-                out += "%s " % self._char_vert
-            length = 0
-            for cell, width, align in zip(line, self._width, self._align):
-                length += 1
+            cells = []
+            for cell, width, align in zip(line, self._width, aligns):
                 cell_line = cell[i]
                 fill = width - len(cell_line)
-                if isheader:
-                    align = self._header_align[length - 1]
                 if align == "r":
-                    out += fill * space + cell_line
+                    cells.append(fill * space + cell_line)
                 elif align == "c":
-                    out += (int(fill/2) * space + cell_line
-                            + int(fill/2 + fill % 2) * space)
+                    cells.append(int(fill/2) * space + cell_line
+                                 + int(fill/2 + fill % 2) * space)
                 else:
-                    out += cell_line + fill * space
-                if length < len(line):
-                    out += " %s " % [space,
-                                     self._char_vert][self._has_vlines()]
-            out += "%s\n" % ['', space + self._char_vert][self._has_border()]
-        return out
+                    cells.append(cell_line + fill * space)
+            out.append(start + separator.join(cells) + end)
+        return "".join(out)
 
     def _splitit(self, line, isheader):
         """Split each element of line to fit the column width
@@ -627,7 +850,7 @@ class Texttable:
                 if c.strip() == "":
                     array.append("")
                 else:
-                    array.extend(tw.wrap(c, width))
+                    array.extend(_wrap(c, width))
             line_wrapped.append(array)
         max_cell_lines = reduce(max, list(map(len, line_wrapped)))
         for cell, valign in zip(line_wrapped, self._valign):
@@ -644,36 +867,864 @@ class Texttable:
         return line_wrapped
 
 
+class OutputMismatch(BaseException):
+    """Raised in a program being tested once its output can no longer match
+    the expected output
+
+    This is not an Exception so that the program's own except Exception:
+    clauses do not catch it.
+    """
+    pass
+
+
+class OutputLimitExceeded(BaseException):
+    """Raised in a program being tested when it prints more than the output
+    limit
+    """
+    pass
+
+
+class OutputLimitError(Exception):
+    """Raised when a program prints more than the output limit, with the
+    head of its output and the number of bytes it printed
+    """
+
+    def __init__(self, output, size):
+        super().__init__(output, size)
+        self.output = output
+        self.size = size
+
+
+class LineLimitExceeded(BaseException):
+    """Raised in a program being tested when it runs more lines than the
+    line limit
+    """
+    pass
+
+
+class LineLimitError(Exception):
+    """Raised when a program runs more lines than the line limit, with its
+    output so far
+    """
+
+    def __init__(self, output, line_limit):
+        super().__init__(output, line_limit)
+        self.output = output
+        self.line_limit = line_limit
+
+
+class ComparingOutput:
+    """Output of a program that is checked against the expected output as it
+    is written
+
+    Output matches if it is the same as the expected output apart from
+    trailing whitespace. At the first write that makes a match impossible,
+    the output is kept up to MISMATCH_CONTEXT characters past the difference
+    and OutputMismatch is raised, as it is for any writes after that.
+    """
+
+    def __init__(self, expected_output):
+        self._expected = expected_output.rstrip()
+        self._out = io.StringIO()
+        self._length = 0
+        self.mismatched = False
+
+    def write(self, s):
+        if self.mismatched:
+            raise OutputMismatch()
+        overlap = self._expected[self._length:self._length + len(s)]
+        if s.startswith(overlap) and (len(s) == len(overlap) or s[len(overlap):].isspace()):
+            self._length += len(s)
+            return self._out.write(s)
+        i = len(path.commonprefix([s, overlap]))
+        if i == len(overlap):
+            # Past the end of the expected output, where only whitespace
+            # may follow
+            i = len(s) - len(s[i:].lstrip())
+        self._out.write(s[:i + MISMATCH_CONTEXT])
+        self.mismatched = True
+        raise OutputMismatch()
+
+    def getvalue(self):
+        if self.mismatched:
+            return self._out.getvalue() + MISMATCH_NOTE
+        return self._out.getvalue()
+
+
 class Executor:
 
-    def __init__(self, filename, bytecode, test_input):
+    def __init__(self, filename, bytecode, test_input, expected_output=None,
+                 output_limit=None, measure_memory=False, count_lines=False, line_limit=None):
+        """If expected_output is given, the program is stopped as soon as its
+        output differs from it. If output_limit is given, the program is
+        stopped once it prints more than that many bytes (encoded as UTF-8).
+        If line_limit is given, the program is stopped once it runs more than
+        that many lines, which also counts lines.
+
+        Before Python 3.12, lines are counted with a trace function, which
+        Python turns off when it stops the program. A program that catches
+        the exception with a bare except: then carries on uncounted, though
+        it is still reported as over the line limit.
+
+        After execute(), stats is the wall time and CPU time in seconds, the
+        peak memory in bytes allocated by the program if measure_memory is
+        true and the number of lines of the program run if count_lines is
+        true (otherwise None).
+        """
+        self._filename = filename
         self._bytecode = bytecode
-        self._in = io.StringIO(test_input)
-        self._out = io.StringIO()
-        self._scope = BASE_SCOPE.copy()
-        self._scope['__file__'] = filename
-        self._scope['__builtins__'] = __builtins__.__dict__.copy()
-        self._scope['__builtins__']['input'] = self._input
-        self._scope['__builtins__']['print'] = self._print
+        if isinstance(test_input, Fixture):
+            self._in = test_input.reader()
+        else:
+            self._in = io.StringIO(test_input)
+        if expected_output is None:
+            self._out = io.StringIO()
+        else:
+            self._out = ComparingOutput(expected_output)
+        self._limit = output_limit
+        self._size = 0
+        self._measure_memory = measure_memory
+        self._count_lines = count_lines or line_limit is not None
+        self._line_limit = line_limit
+        self._line_stop = float('inf') if line_limit is None else line_limit
+        self._lines = 0
+        self._monitoring = False
+        self.stats = None
+        scope_builtins = BASE_BUILTINS.copy()
+        scope_builtins['input'] = self._input
+        scope_builtins['print'] = self._print
+        self._scope = dict(BASE_SCOPE, __file__=filename,
+                           __builtins__=scope_builtins)
 
     def execute(self):
-        exec(self._bytecode, self._scope, self._scope)
+        peak_memory = None
+        if self._measure_memory:
+            # Tracing slows programs down a lot, so it is only on while they
+            # run unless something else turned it on
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            base_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        if self._count_lines:
+            self._start_counting()
+        wall_time = time.perf_counter()
+        cpu_time = time.thread_time()
+        try:
+            exec(self._bytecode, self._scope, self._scope)
+        except SystemExit:
+            # exit() ends the program as if it ran to the end, and its output
+            # is still checked
+            pass
+        except OutputMismatch:
+            pass
+        except OutputLimitExceeded:
+            pass
+        except LineLimitExceeded:
+            pass
+        finally:
+            cpu_time = time.thread_time() - cpu_time
+            wall_time = time.perf_counter() - wall_time
+            if self._count_lines:
+                self._stop_counting()
+            if self._measure_memory:
+                peak_memory = max(0, tracemalloc.get_traced_memory()[1] - base_memory)
+                if started:
+                    tracemalloc.stop()
+            self.stats = (wall_time, cpu_time, peak_memory,
+                          self._lines if self._count_lines else None)
+        if self._limit is not None and self._size > self._limit:
+            raise OutputLimitError(self._out.getvalue()[:OUTPUT_LIMIT_HEAD], self._size)
+        if self._lines > self._line_stop:
+            raise LineLimitError(self._out.getvalue(), self._line_limit)
         return self._out.getvalue()
 
+    def _start_counting(self):
+        if LINE_MONITORING:
+            monitoring = sys.monitoring
+            try:
+                monitoring.use_tool_id(monitoring.PROFILER_ID, 'automarker')
+            except ValueError:
+                # Another profiler or program being tested has the tool ID
+                pass
+            else:
+                self._monitoring = True
+                events = monitoring.events
+                monitoring.register_callback(
+                    monitoring.PROFILER_ID, events.LINE, self._monitor_line)
+                monitoring.register_callback(
+                    monitoring.PROFILER_ID, events.JUMP, self._monitor_jump)
+                monitoring.set_events(monitoring.PROFILER_ID, events.LINE | events.JUMP)
+                return
+        self._trace = sys.gettrace()
+        sys.settrace(self._trace_call)
+
+    def _stop_counting(self):
+        if not self._monitoring:
+            sys.settrace(self._trace)
+            return
+        monitoring = sys.monitoring
+        events = monitoring.events
+        monitoring.set_events(monitoring.PROFILER_ID, events.NO_EVENTS)
+        for event in (events.LINE, events.JUMP):
+            monitoring.register_callback(monitoring.PROFILER_ID, event, None)
+        monitoring.free_tool_id(monitoring.PROFILER_ID)
+        self._monitoring = False
+
+    def _monitor_line(self, code, line_number):
+        # Lines elsewhere, such as in input() and print(), are never called
+        # back for again
+        if code.co_filename != self._filename:
+            return sys.monitoring.DISABLE
+        self._lines += 1
+        if self._lines > self._line_stop:
+            raise LineLimitExceeded()
+
+    def _monitor_jump(self, code, offset, destination):
+        # Loops jump back with JUMP_BACKWARD, never with a branch, and a jump
+        # always goes the same way, so jumps forward are never called back
+        # for again
+        if code.co_filename != self._filename or destination > offset:
+            return sys.monitoring.DISABLE
+        self._lines += 1
+        if self._lines > self._line_stop:
+            raise LineLimitExceeded()
+
+    def _trace_call(self, frame, event, arg):
+        # Only lines in the program itself are counted, not in the modules it
+        # imports or in input() and print()
+        if frame.f_code.co_filename != self._filename:
+            return None
+        # Line events miss loops on one line, so every bytecode is traced to
+        # find new lines and jumps back, as sys.monitoring reports them
+        frame.f_trace_opcodes = True
+        last_line = last_offset = -1
+
+        def trace_opcode(frame, event, arg):
+            nonlocal last_line, last_offset
+            if event != 'opcode':
+                return trace_opcode
+            line = frame.f_lineno
+            offset = frame.f_lasti
+            if line != last_line or offset <= last_offset:
+                self._lines += (line != last_line) + (offset <= last_offset)
+                if self._lines > self._line_stop:
+                    raise LineLimitExceeded()
+            last_line = line
+            last_offset = offset
+            return trace_opcode
+        return trace_opcode
+
     def _input(self, prompt=None):
-        with mock.patch('sys.stdin', new=self._in):
-            return input()
+        # Like input() reading from a redirected stdin, except that the prompt
+        # is not echoed so it does not end up in the output
+        line = self._in.readline()
+        if not line:
+            raise EOFError('EOF when reading a line')
+        if line[-1] == '\n':
+            return line[:-1]
+        return line
+
+    def _print(self, *args, sep=' ', end='\n', file=None, flush=False):
+        if file is not None:
+            return print(*args, sep=sep, end=end, file=file, flush=flush)
+        if sep is None:
+            sep = ' '
+        elif not isinstance(sep, str):
+            raise TypeError('sep must be None or a string, not ' + type(sep).__name__)
+        if end is None:
+            end = '\n'
+        elif not isinstance(end, str):
+            raise TypeError('end must be None or a string, not ' + type(end).__name__)
+        strings = []
+        try:
+            for arg in args:
+                strings.append(str(arg))
+        except BaseException:
+            # print() writes each argument as it goes, so keep what it would
+            # have written before the failing argument
+            if strings:
+                self._write(sep.join(strings) + sep)
+            raise
+        text = sep.join(strings) + end
+        if self._limit is not None:
+            return self._write(text)
+        self._out.write(text)
+
+    def _write(self, text):
+        if self._limit is None:
+            return self._out.write(text)
+        size = len(text) if text.isascii() else len(text.encode('utf-8', 'surrogatepass'))
+        if self._size > self._limit:
+            # The program carried on after OutputLimitExceeded, so only count
+            # what it prints
+            self._size += size
+            raise OutputLimitExceeded()
+        self._size += size
+        if self._size <= self._limit:
+            return self._out.write(text)
+        fits = self._limit - (self._size - size)
+        self._out.write(text.encode('utf-8', 'surrogatepass')[:fits].decode('utf-8', 'ignore'))
+        raise OutputLimitExceeded()
+
+
+class SandboxError(Exception):
+    """Raised when a program run in a Sandbox fails"""
+    pass
+
+
+class SandboxTimeout(Exception):
+    """Raised when a program run in a Sandbox exceeds its time limit"""
+    pass
+
+
+class SandboxMemoryError(SandboxError):
+    """Raised when a program run in a Sandbox runs out of memory"""
+    pass
 
-    def _print(self, *args, **kwargs):
-        with mock.patch('sys.stdout', new=self._out):
-            return print(*args, **kwargs)
+
+def _set_memory_limit(memory_limit):
+    """Limit the address space of this process to memory_limit bytes, where
+    the platform supports it
+    """
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return
+    try:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            memory_limit = min(memory_limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard))
+    except (AttributeError, ValueError, OSError):
+        pass
+
+
+def _rss():
+    """Return the resident set size of this process in bytes, or None if it
+    cannot be found
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Only the peak is available here, in bytes on macOS and KB elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _sandbox_main(conn, memory_limit=None, measure_rss=False):
+    if memory_limit:
+        _set_memory_limit(memory_limit)
+    filename = bytecode = None
+    outputs = {}
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request[1] is not None:
+            filename, bytecode = request[0], marshal.loads(request[1])
+        test_input, expected_output, expected_key = request[2:5]
+        if expected_key is not None:
+            if expected_output is None:
+                expected_output = outputs[expected_key]
+            else:
+                outputs[expected_key] = expected_output
+        executor = None
+        try:
+            # A fixture that can't be read fails the test case, not the child
+            executor = Executor(filename, bytecode, test_input, expected_output, *request[5:])
+            response = (True, executor.execute())
+        except (OutputLimitError, LineLimitError) as e:
+            response = (False, e)
+        except MemoryError:
+            response = (False, SandboxMemoryError('Program ran out of memory'))
+        except Exception as e:
+            response = (False, str(e))
+        conn.send(response + (executor and executor.stats, _rss() if measure_rss else None))
+
+
+class Sandbox:
+    """Runs programs in a child process that is killed and restarted when a
+    program exceeds the time limit or brings the process down
+
+    Anything a program leaves behind, such as imported modules or threads,
+    stays in the child. The child is replaced before the next submission
+    once it has run recycle_after submissions or its resident set size is
+    more than recycle_rss bytes (where this can be found). If memory_limit
+    is given, the child's address space is limited to that many bytes
+    (where the platform supports it).
+    """
+
+    def __init__(self, timeout, recycle_after=None, recycle_rss=None, memory_limit=None):
+        self.timeout = timeout
+        self.recycle_after = recycle_after
+        self.recycle_rss = recycle_rss
+        self.memory_limit = memory_limit
+        self._process = None
+        self._conn = None
+        self._filename = None
+        # Keys of the expected outputs the child keeps
+        self._outputs = set()
+        # Submissions run by the child, and the one it is running, which a
+        # restart part way through does not change
+        self._submissions = 0
+        self._submission = None
+        self._rss = None
+        # As for Executor, for the last program run
+        self.stats = None
+
+    def run(self, filename, bytecode, test_input, expected_output=None, output_limit=None,
+            measure_memory=False, count_lines=False, line_limit=None, expected_key=None):
+        """If expected_key is given, the child keeps expected_output under
+        that key, and later runs with the same key don't send it again
+        """
+        self.stats = None
+        new_submission = filename != self._submission
+        if self._process and new_submission and self._worn_out():
+            self.close()
+        if not self._process:
+            self._start()
+        if new_submission or not self._submissions:
+            self._submission = filename
+            self._submissions += 1
+        # The child keeps the last program it was sent, so each submission is
+        # only sent once for all of its test cases
+        code = None
+        if filename != self._filename:
+            code = marshal.dumps(bytecode)
+            self._filename = filename
+        if expected_key is not None:
+            if expected_key in self._outputs:
+                expected_output = None
+            else:
+                self._outputs.add(expected_key)
+        self._conn.send((filename, code, test_input, expected_output, expected_key,
+                         output_limit, measure_memory, count_lines, line_limit))
+        if not self._conn.poll(self.timeout):
+            self.close()
+            self.stats = (self.timeout, None, None, None)
+            raise SandboxTimeout()
+        try:
+            success, output, self.stats, self._rss = self._conn.recv()
+        except EOFError:
+            self._process.join()
+            exitcode = self._process.exitcode
+            self.close()
+            raise SandboxError(
+                'Program exited unexpectedly (exit code {})'.format(exitcode))
+        if not success:
+            if isinstance(output, (OutputLimitError, LineLimitError)):
+                raise output
+            if isinstance(output, SandboxMemoryError):
+                # The child may not have recovered, so start a new one
+                self.close()
+                raise output
+            raise SandboxError(output)
+        return output
+
+    def _worn_out(self):
+        """Return whether the child should be replaced before the next
+        submission
+        """
+        if self.recycle_after and self._submissions >= self.recycle_after:
+            return True
+        return bool(self.recycle_rss and self._rss and self._rss > self.recycle_rss)
+
+    def close(self):
+        if not self._process:
+            return
+        self._conn.close()
+        self._process.kill()
+        self._process.join()
+        self._process = None
+        self._conn = None
+        self._filename = None
+        self._outputs.clear()
+        self._submissions = 0
+        self._rss = None
+
+    def _start(self):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_sandbox_main, args=(child_conn, self.memory_limit, bool(self.recycle_rss)),
+            daemon=True)
+        self._process.start()
+        child_conn.close()
+
+
+def digest(*strings):
+    """Return a hex SHA-256 hash of a sequence of strings"""
+    h = hashlib.sha256()
+    for string in strings:
+        h.update(string.encode('utf-8', 'surrogatepass'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class DiskCache:
+    """Cache of byte strings stored as files in a folder
+
+    Reading an entry marks it as recently used. When the files grow beyond
+    max_size bytes, the least recently used ones are deleted. The cache is
+    best effort: entries that cannot be read or written are treated as
+    missing.
+    """
+
+    def __init__(self, folder, max_size=DEFAULT_CACHE_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self._size = None
+
+    def get(self, key):
+        filename = self._path(key)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            os.utime(filename)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        filename = self._path(key)
+        temp = '{}.{}.{}.tmp'.format(filename, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(path.dirname(filename), exist_ok=True)
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, filename)
+        except OSError:
+            return
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += len(data)
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache is down to
+        three quarters of max_size, so that eviction does not happen on every
+        put
+        """
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, filename in entries:
+            if self._size <= self.max_size * 3 // 4:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            self._size -= size
+
+    def _path(self, key):
+        return path.join(self.folder, key[:2], key)
+
+    def _entries(self):
+        """Return (last used, size, filename) for each entry"""
+        try:
+            subfolders = [entry.path for entry in os.scandir(self.folder)
+                          if entry.is_dir()]
+        except OSError:
+            return []
+        entries = []
+        for subfolder in subfolders:
+            try:
+                for entry in os.scandir(subfolder):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                continue
+        return entries
+
+
+class BytecodeCache(DiskCache):
+    """Compiles submissions, caching the bytecode (or the syntax error) under
+    the submission's digest and the Python version
+    """
+
+    SYNTAX_ERRORS = {e.__name__: e for e in (SyntaxError, IndentationError, TabError)}
+
+    def compile(self, source, filename, source_digest):
+        key = digest(importlib.util.MAGIC_NUMBER.hex(), source_digest)
+        data = self.get(key)
+        if data is not None:
+            try:
+                name, value = marshal.loads(data)
+            except (EOFError, ValueError, TypeError):
+                name = None
+            if name == 'bytecode':
+                return value
+            if name in self.SYNTAX_ERRORS:
+                raise self.SYNTAX_ERRORS[name](*value)
+        try:
+            bytecode = compile(source, filename, 'exec')
+        except SyntaxError as e:
+            if type(e).__name__ in self.SYNTAX_ERRORS:
+                self.put(key, marshal.dumps((type(e).__name__, e.args)))
+            raise
+        self.put(key, marshal.dumps(('bytecode', bytecode)))
+        return bytecode
+
+
+class ResultCache(DiskCache):
+    """Results of running test cases, keyed by the submission's digest, the
+    test case's digest and the options of the Tester that ran them
+    """
+
+    def key(self, source_digest, test_case, options):
+        return digest(str(RESULT_CACHE_VERSION), importlib.util.MAGIC_NUMBER.hex(),
+                      source_digest, test_case.digest(), options)
+
+    def get_result(self, key, test_case):
+        data = self.get(key)
+        if data is None:
+            return None
+        try:
+            success, output, status, output_size, stats = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return None
+        result = TestResult(test_case, success, output, status, output_size)
+        result.wall_time, result.cpu_time, result.peak_memory, result.lines = stats
+        result.cached = True
+        return result
+
+    def put_result(self, key, result):
+        self.put(key, marshal.dumps(
+            (result.success, result.output, result.status, result.output_size,
+             (result.wall_time, result.cpu_time, result.peak_memory, result.lines))))
+
+
+# Header lines of sections taken from a Fixture
+FIXTURE_REGEX = re.compile(r'\[file:\s*([^\]]*?)\s*\]')
+
+
+class Fixture:
+    """File that a test case takes its input or expected output from
+
+    The file is memory-mapped the first time it is used in a process and the
+    map is shared read-only by all runs in that process, which read input()
+    lines straight from it. Only the file name is pickled. A file that has
+    changed is mapped again.
+    """
+
+    _maps = {}
+    _digests = {}
+    _lock = threading.Lock()
+
+    def __init__(self, filename, encoding):
+        self.filename = filename
+        self.encoding = encoding
+
+    def label(self):
+        return '[file: {}]'.format(self.filename)
+
+    def reader(self):
+        """Return a file-like object for input() to read lines from"""
+        if '\r\n'.encode(self.encoding, 'replace') != b'\r\n':
+            return io.StringIO(self.read())
+        return FixtureReader(self._map(), self.encoding)
+
+    def read(self):
+        data = self._map()[:]
+        return data.decode(self.encoding).replace('\r\n', '\n').replace('\r', '\n')
+
+    def digest(self):
+        key, data = self._stat_map()
+        result = Fixture._digests.get(key)
+        if result is None:
+            result = Fixture._digests[key] = hashlib.sha256(data).hexdigest()
+        return result
+
+    def _map(self):
+        return self._stat_map()[1]
+
+    def _stat_map(self):
+        stat = os.stat(self.filename)
+        key = (self.filename, stat.st_size, stat.st_mtime_ns)
+        with Fixture._lock:
+            data = Fixture._maps.get(key)
+            if data is None:
+                for old in [old for old in Fixture._maps if old[0] == self.filename]:
+                    del Fixture._maps[old]
+                if not stat.st_size:
+                    data = b''
+                else:
+                    with open(self.filename, 'rb') as f:
+                        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                Fixture._maps[key] = data
+        return key, data
+
+    def __repr__(self):
+        return 'Fixture({!r})'.format(self.filename)
+
+
+class FixtureReader:
+    """Reads lines from a memory-mapped Fixture with universal newlines"""
+
+    def __init__(self, data, encoding):
+        self._data = data
+        self._encoding = encoding
+        self._pos = 0
+
+    def readline(self):
+        data = self._data
+        start = self._pos
+        if start >= len(data):
+            return ''
+        end = data.find(b'\n', start)
+        if end < 0:
+            end = len(data)
+        cr = data.find(b'\r', start, end)
+        if cr >= 0:
+            self._pos = cr + 2 if data[cr + 1:cr + 2] == b'\n' else cr + 1
+            return data[start:cr].decode(self._encoding) + '\n'
+        if end == len(data):
+            self._pos = end
+            return data[start:end].decode(self._encoding)
+        self._pos = end + 1
+        return data[start:end + 1].decode(self._encoding)
+
+
+class FolderIndex(DiskCache):
+    """Listings of the folders below a submissions folder, kept with each
+    folder's modification time so that a search only lists folders that
+    have changed since the last one
+    """
+
+    def get_index(self, folder):
+        data = self.get(digest(path.abspath(folder)))
+        if data is None:
+            return {}
+        try:
+            index = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def put_index(self, folder, index):
+        self.put(digest(path.abspath(folder)), marshal.dumps(index))
+
+
+# A folder changed this recently may change again within the resolution of
+# its modification time, so its listing is not trusted next time
+INDEX_MIN_AGE_NS = 2 * 10 ** 9
+
+
+def _list_folder(folder, index):
+    """Return the names of a folder's subfolders and of all its entries,
+    reusing the listing in index if the folder has not been modified
+    """
+    stat = os.stat(folder)
+    listing = index.get(folder)
+    if listing and listing[0] == stat.st_mtime_ns:
+        return listing[1], listing[2]
+    subfolders = []
+    names = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            names.append(entry.name)
+            try:
+                if entry.is_dir():
+                    subfolders.append(entry.name)
+            except OSError:
+                pass
+    mtime = stat.st_mtime_ns
+    if time.time_ns() - mtime < INDEX_MIN_AGE_NS:
+        mtime = None
+    index[folder] = (mtime, subfolders, names)
+    return subfolders, names
+
+
+def find_files(folder, file_filter, subfolders=False, index=None):
+    """Return the paths in folder (and its subfolders) whose names match
+    file_filter, like glob.glob(path.join(folder, '**', file_filter),
+    recursive=True) but without treating folder as a pattern
+
+    As with glob, names starting with a dot only match a filter starting
+    with a dot, and hidden subfolders are skipped. If index is given, it is
+    used and updated as by _list_folder() and pruned to the folders visited.
+    """
+    pattern = re.compile(fnmatch.translate(path.normcase(file_filter)))
+    match_hidden = file_filter.startswith('.')
+    visited = {} if index is None else index
+    old_index = dict(visited)
+    visited.clear()
+    files = []
+    pending = [folder]
+    while pending:
+        current = pending.pop()
+        try:
+            names_subfolders, names = _list_folder(current, old_index)
+        except OSError:
+            continue
+        visited[current] = old_index[current]
+        for name in names:
+            if (match_hidden or name[0] != '.') and pattern.match(path.normcase(name)):
+                files.append(path.join(current, name))
+        if subfolders:
+            pending.extend(path.join(current, name) for name in names_subfolders
+                           if name[0] != '.')
+    return files
 
 
 class TestCase:
+    """Test case whose input and expected output are either strings or taken
+    from Fixture files
+    """
 
-    def __init__(self, test_input, expected_output):
-        self.test_input = test_input
-        self.expected_output = expected_output
+    def __init__(self, test_input, expected_output, input_fixture=None, output_fixture=None):
+        self._test_input = test_input
+        self._expected_output = expected_output
+        self.input_fixture = input_fixture
+        self.output_fixture = output_fixture
+        self._digest = None
+
+    @property
+    def test_input(self):
+        if self.input_fixture:
+            return self.input_fixture.read()
+        return self._section(self._test_input)
+
+    @property
+    def expected_output(self):
+        if self.output_fixture:
+            return self.output_fixture.read()
+        return self._section(self._expected_output)
+
+    def input_source(self):
+        """Return what a program reads its input from, a string or a Fixture"""
+        return self.input_fixture or self.test_input
+
+    def display_input(self):
+        return self.input_fixture.label() if self.input_fixture else self.test_input
+
+    def display_output(self):
+        return self.output_fixture.label() if self.output_fixture else self.expected_output
+
+    def digest(self):
+        if not (self.input_fixture or self.output_fixture):
+            if self._digest is None:
+                self._digest = digest(self.test_input, self.expected_output)
+            return self._digest
+        # Fixture files can change between runs, so they are hashed each time
+        # (Fixture caches the hash until the file changes)
+        return digest(*(
+            'file:' + fixture.digest() if fixture else self._section(section)
+            for fixture, section in ((self.input_fixture, self._test_input),
+                                     (self.output_fixture, self._expected_output))))
+
+    def _section(self, section):
+        return section
 
     def __repr__(self):
         return repr({
@@ -682,94 +1733,743 @@ class TestCase:
         })
 
 
+class TestCaseFileChanged(Exception):
+    """Raised when a test case is read from a file that has changed since it
+    was loaded
+    """
+    pass
+
+
+# Errors reading a test case, whose file or fixtures can be changed or
+# removed while submissions are marked
+TEST_CASE_ERRORS = (OSError, ValueError, TestCaseFileChanged)
+
+
+class TestCaseFile:
+    """Test case file that is scanned for section headers without loading it
+    into memory
+
+    Only the offsets of the sections are kept. The text of a section is read
+    and decoded each time it is needed, as if the whole file had been read in
+    text mode with universal newlines. The file is memory-mapped only while
+    it is scanned, so a file that is edited while it is loaded is detected
+    rather than read halfway through a change.
+    """
+
+    # Bytes decoded at a time when checking the encoding
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, filename, encoding=None):
+        """Raises OSError if the file cannot be read and UnicodeDecodeError if
+        it is not in the given encoding (by default, that of open())
+        """
+        self.filename = filename
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        with open(filename, 'rb') as f:
+            self._stat = self._key(os.fstat(f.fileno()))
+            # Section headers are found by searching bytes, which only works
+            # if newlines are encoded as in ASCII
+            self._ascii_newlines = '\r\n'.encode(self.encoding, 'replace') == b'\r\n'
+            if self._ascii_newlines and self._stat[0]:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    decoder = codecs.getincrementaldecoder(self.encoding)()
+                    for start in range(0, len(m), self.CHUNK_SIZE):
+                        decoder.decode(m[start:start + self.CHUNK_SIZE])
+                    decoder.decode(b'', True)
+
+    def parse(self, prefix):
+        """Return the test cases in the file, or None if its sections do not
+        pair up into test cases
+        """
+        if not self._ascii_newlines:
+            with open(self.filename, encoding=self.encoding) as f:
+                return parse_test_cases(f.read(), prefix, path.dirname(self.filename),
+                                        self.encoding)
+        if not self._stat[0]:
+            return None
+        # Like the ^prefix[^\n]*\n of parse_test_cases(), with \r\n and \r as
+        # newlines too. Matches are checked for a line start afterwards, which
+        # is much faster than a lookbehind as the prefix can then be searched
+        # for as a literal.
+        header = re.compile(re.escape(prefix.encode(self.encoding)) +
+                            b'[^\r\n]*(?:\r\n|\r|\n)')
+        with open(self.filename, 'rb') as f:
+            if self._key(os.fstat(f.fileno())) != self._stat:
+                raise TestCaseFileChanged(
+                    'Test case file has changed since it was loaded: ' + self.filename)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                bounds = []
+                fixtures = []
+                for match in header.finditer(m):
+                    start = match.start()
+                    if start and m[start - 1] not in b'\r\n':
+                        continue
+                    bounds.append(start)
+                    bounds.append(match.end())
+                    fixtures.append(parse_fixture(match.group().decode(self.encoding),
+                                                  path.dirname(self.filename), self.encoding))
+                size = len(m)
+        if len(bounds) < 4 or len(bounds) % 4:
+            return None
+        bounds.append(size)
+        return [FileTestCase(self, (bounds[i + 1], bounds[i + 2]),
+                             (bounds[i + 3], bounds[i + 4]),
+                             fixtures[i // 2], fixtures[i // 2 + 1])
+                for i in range(0, len(bounds) - 1, 4)]
+
+    def read(self, start, end):
+        with open(self.filename, 'rb') as f:
+            if self._key(os.fstat(f.fileno())) != self._stat:
+                raise TestCaseFileChanged(
+                    'Test case file has changed since it was loaded: ' + self.filename)
+            f.seek(start)
+            data = f.read(end - start)
+        return data.decode(self.encoding).replace('\r\n', '\n').replace('\r', '\n')
+
+    def changed(self):
+        try:
+            return self._key(os.stat(self.filename)) != self._stat
+        except OSError:
+            return True
+
+    @staticmethod
+    def _key(stat):
+        return stat.st_size, stat.st_mtime_ns
+
+
+class FileTestCase(TestCase):
+    """Test case whose sections are read from a TestCaseFile when needed
+
+    Only the file name and offsets are pickled, so test cases are cheap to
+    send to worker processes.
+    """
+
+    def __init__(self, test_case_file, input_bounds, output_bounds,
+                 input_fixture=None, output_fixture=None):
+        super().__init__(input_bounds, output_bounds, input_fixture, output_fixture)
+        self.test_case_file = test_case_file
+
+    def _section(self, bounds):
+        return self.test_case_file.read(*bounds)
+
+
+def parse_fixture(header, folder, encoding):
+    """Return the Fixture named in a section header line, if any
+
+    Raises OSError if the file cannot be found.
+    """
+    match = FIXTURE_REGEX.search(header)
+    if not match:
+        return None
+    filename = path.join(folder, match.group(1))
+    os.stat(filename)
+    return Fixture(filename, encoding)
+
+
+def parse_test_cases(test_cases_raw, prefix, folder='', encoding=None):
+    """Return the test cases in a string, or None if its sections do not pair
+    up into test cases
+
+    Fixture files are relative to folder and read with the given encoding (by
+    default, that of open()).
+    """
+    encoding = encoding or locale.getpreferredencoding(False)
+    headers = list(re.finditer(r'^' + re.escape(prefix) + r'[^\n]*\n',
+                               test_cases_raw, flags=re.MULTILINE))
+    if len(headers) < 2 or len(headers) % 2:
+        return None
+    ends = [header.start() for header in headers[1:]] + [len(test_cases_raw)]
+    test_cases = []
+    for i in range(0, len(headers), 2):
+        test_cases.append(TestCase(
+            test_cases_raw[headers[i].end():ends[i]],
+            test_cases_raw[headers[i + 1].end():ends[i + 1]],
+            parse_fixture(headers[i].group(), folder, encoding),
+            parse_fixture(headers[i + 1].group(), folder, encoding)))
+    return test_cases
+
+
+def test_case_output_limit(output_limit, expected_output):
+    """Return the output limit for a test case, which is raised to leave
+    room for its expected output if that is larger
+    """
+    if output_limit is None:
+        return None
+    size = len(expected_output.encode('utf-8', 'surrogatepass'))
+    return max(output_limit, size + OUTPUT_LIMIT_MARGIN)
+
+
+class SectionCache:
+    """Inputs and expected outputs of test cases, read and decoded once for
+    a run
+
+    Test cases from a file or a fixture are otherwise read and decoded again
+    for every submission and for the report. Sections are kept until they add
+    up to size characters, and any after that are read each time. Input
+    fixtures are kept as they are, since programs read them from the file.
+    """
+
+    def __init__(self, output_limit=None, size=SECTION_CACHE_SIZE):
+        self.output_limit = output_limit
+        self._space = size
+        self._inputs = {}
+        self._outputs = {}
+        self._lock = threading.Lock()
+
+    def input_source(self, test_case):
+        """Return what a program reads a test case's input from, as
+        TestCase.input_source()
+
+        Raises TEST_CASE_ERRORS if the test case cannot be read.
+        """
+        test_input = self._inputs.get(test_case)
+        if test_input is not None:
+            return test_input
+        test_input = test_case.input_source()
+        with self._lock:
+            if test_case not in self._inputs and self._reserve(
+                    0 if isinstance(test_input, Fixture) else len(test_input)):
+                self._inputs[test_case] = test_input
+        return test_input
+
+    def expected_output(self, test_case):
+        """Return a test case's expected output, its output limit (see
+        test_case_output_limit()) and a key that stays the same for the run
+        if the output is kept, otherwise None
+
+        Raises TEST_CASE_ERRORS if the test case cannot be read.
+        """
+        entry = self._outputs.get(test_case)
+        if entry is not None:
+            return entry
+        expected_output = test_case.expected_output
+        entry = (expected_output, test_case_output_limit(self.output_limit, expected_output),
+                 None)
+        with self._lock:
+            if test_case not in self._outputs and self._reserve(len(expected_output)):
+                entry = self._outputs[test_case] = entry[:2] + (len(self._outputs),)
+        return entry
+
+    def display(self, test_case):
+        """Return a test case's input and expected output as shown in the
+        report, as TestCase.display_input() and display_output()
+
+        Raises TEST_CASE_ERRORS if the test case cannot be read.
+        """
+        test_input = self.input_source(test_case)
+        if isinstance(test_input, Fixture):
+            test_input = test_input.label()
+        if test_case.output_fixture:
+            return test_input, test_case.output_fixture.label()
+        return test_input, self.expected_output(test_case)[0]
+
+    def _reserve(self, size):
+        if size > self._space:
+            return False
+        self._space -= size
+        return True
+
+
 class TestResult:
 
-    def __init__(self, test_case, success, output):
+    def __init__(self, test_case, success, output, status=None, output_size=None):
         self.test_case = test_case
         self.success = success
         self.output = output
+        self.status = status or (PASSED if success else FAILED)
+        # Bytes printed by a program that exceeded the output limit, of which
+        # output only has the head
+        self.output_size = output_size
+        # Seconds, bytes and lines run used by the program, or None if not
+        # measured
+        self.wall_time = None
+        self.cpu_time = None
+        self.peak_memory = None
+        self.lines = None
+        self.cached = False
 
     def __repr__(self):
         return repr({
             'test_case': self.test_case,
             'success': self.success,
-            'output': self.output
+            'output': self.output,
+            'status': self.status,
+            'output_size': self.output_size,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'peak_memory': self.peak_memory,
+            'lines': self.lines
         })
 
 
+# Errors that stop a submission from being marked at all. Besides syntax
+# errors, a file can vanish or be caught part way through being saved.
+COMPILE_ERRORS = (SyntaxError, OSError, ValueError)
+
+
 class SubmissionResult:
 
     def __init__(self, filename, test_results=None, compile_error=None):
         self.filename = filename
         self.test_results = test_results
+        # One of COMPILE_ERRORS if the submission could not be marked
         self.compile_error = compile_error
+        # Hash of the file's contents, if it could be read
+        self.content_digest = None
+        # File that was marked instead of this identical one
+        self.duplicate_of = None
 
     def __repr__(self):
         return repr({
             'filename': self.filename,
             'test_results': self.test_results,
-            'compile_error': self.compile_error
+            'compile_error': self.compile_error,
+            'duplicate_of': self.duplicate_of
         })
 
+
+# Names through which a program could see its own file name. Identical
+# submissions that use any of them are marked separately.
+FILENAME_ACCESS_REGEX = re.compile(
+    rb'__file__|co_filename|traceback|inspect|_getframe|exc_info|tb_frame|f_code|'
+    rb'globals|locals|vars')
+
+
+# Names through which a program could see its line numbers, source or
+# docstrings, which normalisation ignores. Submissions that use any of them
+# are only grouped with identical ones.
+NORMALISE_ACCESS_REGEX = re.compile(
+    rb'lineno|__code__|co_|__doc__|__dict__|help|pydoc|linecache|\bdis\b')
+
+
+def normalised_digest(data):
+    """Return a hash of a program's syntax tree, which leaves out comments,
+    formatting, line numbers and docstrings, or None if the program may not
+    be normalised
+    """
+    if NORMALISE_ACCESS_REGEX.search(data):
+        return None
+    try:
+        tree = ast.parse(data)
+        # Some errors are only found when compiling, and their messages have
+        # line numbers
+        compile(tree, '<normalised>', 'exec', dont_inherit=True)
+    except (SyntaxError, ValueError):
+        return None
+    for node in ast.walk(tree):
+        if (isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef))
+                and node.body and isinstance(node.body[0], ast.Expr)
+                and isinstance(node.body[0].value, ast.Constant)
+                and isinstance(node.body[0].value.value, str)):
+            node.body = node.body[1:]
+    return 'ast:' + digest(ast.dump(tree))
+
+
+def hash_submissions(filenames, normalise=False):
+    """Return a dict of the hash of each file's contents and the key of the
+    files that may share its results (None if it must be marked by itself),
+    leaving out files that cannot be read
+
+    Files share results if they are identical or, if normalise is true, if
+    they only differ in comments, formatting or docstrings.
+    """
+    hashes = {}
+    for filename in filenames:
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        content_digest = hashlib.sha256(data).hexdigest()
+        key = None
+        if not FILENAME_ACCESS_REGEX.search(data):
+            key = content_digest
+            if normalise:
+                key = normalised_digest(data) or content_digest
+        hashes[filename] = (content_digest, key)
+    return hashes
+
 class Tester:
 
-    def __init__(self, test_cases):
+    def __init__(self, test_cases, timeout=None, bytecode_cache=None, result_cache=None,
+                 stop_on_mismatch=False, output_limit=None, deduplicate=True, normalise=False,
+                 measure_memory=False, count_lines=False, line_limit=None,
+                 recycle_after=None, recycle_rss=None, memory_limit=None):
+        """recycle_after, recycle_rss and memory_limit are as for Sandbox, and
+        only apply with a timeout
+        """
         self.test_cases = test_cases
-
-    def test(self, filename):
+        self.timeout = timeout
+        self.recycle_after = recycle_after
+        self.recycle_rss = recycle_rss
+        self.memory_limit = memory_limit
+        self.measure_memory = measure_memory
+        self.count_lines = count_lines
+        self.line_limit = line_limit
+        self.deduplicate = deduplicate
+        self.normalise = normalise
+        self.stop_on_mismatch = stop_on_mismatch
+        self.output_limit = output_limit
+        self.bytecode_cache = bytecode_cache
+        self.result_cache = result_cache
+        self.sections = SectionCache(output_limit)
+        # Called with the number of test cases done after each test case
+        self.progress = None
+        self._sandbox = None
+
+    def compile(self, filename):
+        """Return the bytecode of a submission and a digest of its file name
+        and source
+        """
         with open(filename) as f:
             source = f.read()
+        source_digest = digest(filename, source)
+        if self.bytecode_cache:
+            return self.bytecode_cache.compile(source, filename, source_digest), source_digest
+        return compile(source, filename, 'exec'), source_digest
+
+    def options(self):
+        """Return a string of the options that affect test results"""
+        return ('timeout={!r} stop_on_mismatch={!r} output_limit={!r} measure_memory={!r} '
+                'count_lines={!r} line_limit={!r} memory_limit={!r}').format(
+                    self.timeout, self.stop_on_mismatch, self.output_limit,
+                    self.measure_memory, self.count_lines, self.line_limit,
+                    self.memory_limit if self.timeout else None)
+
+    def run(self, filename, bytecode, test_case, source_digest=None):
+        key = None
         try:
-            bytecode = compile(source, filename, 'exec')
-        except SyntaxError as e:
+            if self.result_cache and source_digest:
+                key = self.result_cache.key(source_digest, test_case, self.options())
+                result = self.result_cache.get_result(key, test_case)
+                if result:
+                    return result
+            test_input = self.sections.input_source(test_case)
+            expected = self.sections.expected_output(test_case)
+        except TEST_CASE_ERRORS as e:
+            # Not cached, as the test case may be back by the next run
+            return TestResult(test_case, False, 'Test case could not be read: {}'.format(e))
+        result = self._run(filename, bytecode, test_case, test_input, *expected)
+        # A time out may only be down to a busy computer, so try again next time
+        if key and result.status != TIMED_OUT:
+            self.result_cache.put_result(key, result)
+        return result
+
+    def _run(self, filename, bytecode, test_case, test_input, expected_output, output_limit,
+             expected_key=None):
+        runner = None
+        try:
+            if self.timeout:
+                if not self._sandbox:
+                    self._sandbox = Sandbox(self.timeout, self.recycle_after,
+                                            self.recycle_rss, self.memory_limit)
+                runner = self._sandbox
+                output = runner.run(
+                    filename, bytecode, test_input,
+                    expected_output if self.stop_on_mismatch else None, output_limit,
+                    self.measure_memory, self.count_lines, self.line_limit,
+                    expected_key if self.stop_on_mismatch else None)
+            else:
+                runner = Executor(filename, bytecode, test_input,
+                                  expected_output if self.stop_on_mismatch else None,
+                                  output_limit, self.measure_memory, self.count_lines,
+                                  self.line_limit)
+                output = runner.execute()
+            result = TestResult(test_case, output.rstrip() == expected_output.rstrip(), output)
+        except OutputLimitError as e:
+            result = TestResult(test_case, False, e.output, OUTPUT_LIMIT_EXCEEDED, e.size)
+        except LineLimitError as e:
+            result = TestResult(test_case, False, e.output, LINE_LIMIT_EXCEEDED)
+        except SandboxTimeout:
+            result = TestResult(test_case, False, 'Timed out after {} second(s)'.format(
+                self.timeout), TIMED_OUT)
+        except Exception as e:
+            result = TestResult(test_case, False, str(e))
+        if runner and runner.stats:
+            result.wall_time, result.cpu_time, result.peak_memory, result.lines = runner.stats
+        return result
+
+    def test(self, filename):
+        try:
+            bytecode, source_digest = self.compile(filename)
+        except COMPILE_ERRORS as e:
+            if self.progress:
+                self.progress(len(self.test_cases))
             return SubmissionResult(filename, compile_error=e)
         results = []
         for test_case in self.test_cases:
-            executor = Executor(filename, bytecode, test_case.test_input)
-            try:
-                output = executor.execute()
-                results.append(TestResult(test_case, output.rstrip(
-                ) == test_case.expected_output.rstrip(), output))
-            except Exception as e:
-                results.append(TestResult(test_case, False, str(e)))
+            results.append(self.run(filename, bytecode, test_case, source_digest))
+            if self.progress:
+                self.progress(1)
         return SubmissionResult(filename, test_results=results)
 
+    def test_all(self, filenames):
+        """Yield the SubmissionResult of each file in turn
+
+        Files with identical contents (or equivalent ones, see
+        hash_submissions()) are only marked once, and the others in the group
+        share its test results, unless the program could tell them apart by
+        their file names. When counting lines or with a line limit, only
+        identical files share results, since the lines a program runs depend
+        on its layout.
+        """
+        hashes = hash_submissions(filenames, self.deduplicate and self.normalise and
+                                  not self.count_lines and self.line_limit is None)
+        first = {}
+        marked_for = {}
+        for filename in filenames:
+            _, key = hashes.get(filename, (None, None))
+            if self.deduplicate and key:
+                marked_for[filename] = first.setdefault(key, filename)
+            else:
+                marked_for[filename] = filename
+        copies = {}
+        for filename in filenames:
+            copies[marked_for[filename]] = copies.get(marked_for[filename], 0) + 1
+        shared = {}
+        all_results = self._test_all([filename for filename in filenames
+                                      if marked_for[filename] == filename])
+        try:
+            for filename in filenames:
+                original = marked_for[filename]
+                if original == filename:
+                    file_results = next(all_results)
+                    if copies[filename] > 1:
+                        shared[filename] = file_results
+                else:
+                    file_results = self._copy_results(shared[original], filename)
+                    if self.progress:
+                        self.progress(len(self.test_cases))
+                copies[original] -= 1
+                if not copies[original]:
+                    shared.pop(original, None)
+                if filename in hashes:
+                    file_results.content_digest = hashes[filename][0]
+                yield file_results
+        finally:
+            all_results.close()
+
+    @staticmethod
+    def _copy_results(file_results, filename):
+        compile_error = file_results.compile_error
+        if compile_error:
+            compile_error = copy.copy(compile_error)
+            compile_error.filename = filename
+        result = SubmissionResult(filename, file_results.test_results, compile_error)
+        result.duplicate_of = file_results.filename
+        return result
+
+    def _test_all(self, filenames):
+        try:
+            for filename in filenames:
+                yield self.test(filename)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._sandbox:
+            self._sandbox.close()
+            self._sandbox = None
+
+
+class _Worker:
+    """Runs single test cases for ParallelTester
+
+    A worker compiles a submission once and keeps the bytecode for as long as
+    it is handed test cases from that submission. In a thread pool that is
+    all of them, and in a process pool usually the whole chunk.
+    """
+
+    def __init__(self, tester):
+        self.tester = tester
+        self.filename = None
+        self.bytecode = None
+        self.source_digest = None
+
+    def run(self, filename, index):
+        if filename != self.filename:
+            try:
+                self.bytecode, self.source_digest = self.tester.compile(filename)
+            except COMPILE_ERRORS as e:
+                self.bytecode = e
+            self.filename = filename
+        if isinstance(self.bytecode, COMPILE_ERRORS):
+            return self.bytecode
+        result = self.tester.run(filename, self.bytecode,
+                                 self.tester.test_cases[index], self.source_digest)
+        # The parent process still has the test case, so don't send it back
+        result.test_case = None
+        return result
+
+
+# Worker of a ParallelTester process pool
+_worker = None
+
+
+def _init_worker(tester):
+    global _worker
+    _worker = _Worker(tester)
+
+
+def _run_worker(filename, index):
+    return _worker.run(filename, index)
+
+
+class ParallelTester(Tester):
+    """Tester that spreads test cases over multiple workers
+
+    Test cases run in a pool of worker processes. With a time limit, they
+    already run in one Sandbox process per worker, so the workers are threads
+    instead.
+    """
+
+    def __init__(self, test_cases, workers=DEFAULT_WORKERS, **kwargs):
+        super().__init__(test_cases, **kwargs)
+        self.workers = workers
+        self._kwargs = kwargs
+
+    def _test_all(self, filenames):
+        if self.workers <= 1 or len(filenames) <= 1:
+            yield from super()._test_all(filenames)
+            return
+        testers = []
+        if self.timeout:
+            local = threading.local()
+
+            def run(filename):
+                if not hasattr(local, 'worker'):
+                    local.worker = _Worker(Tester(self.test_cases, **self._kwargs))
+                    local.worker.tester.sections = self.sections
+                    testers.append(local.worker.tester)
+                return [local.worker.run(filename, i) for i in range(len(self.test_cases))]
+            pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        else:
+            pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(Tester(self.test_cases, **self._kwargs),))
+        try:
+            if self.timeout:
+                # A thread pool ignores chunksize, so each task is a whole
+                # submission to keep it on one worker and its Sandbox
+                cells = (cell for cells in pool.map(run, filenames) for cell in cells)
+            else:
+                tasks = [(filename, i) for filename in filenames
+                         for i in range(len(self.test_cases))]
+                chunksize = max(1, len(tasks) // (self.workers * 4))
+                cells = pool.map(_run_worker, *zip(*tasks), chunksize=chunksize)
+            for filename in filenames:
+                results = []
+                for _ in self.test_cases:
+                    results.append(next(cells))
+                    if self.progress:
+                        self.progress(1)
+                if isinstance(results[0], COMPILE_ERRORS):
+                    yield SubmissionResult(filename, compile_error=results[0])
+                    continue
+                for test_case, result in zip(self.test_cases, results):
+                    result.test_case = test_case
+                yield SubmissionResult(filename, test_results=results)
+        finally:
+            # Test cases not yet started are dropped if the caller stops early
+            pool.shutdown(cancel_futures=True)
+            for tester in testers:
+                tester.close()
+
 
 class AutoMarker:
 
     def __init__(self):
         self.test_cases_raw = None
+        self.test_cases_file = None
         self.test_cases = None
         self.prefix = DEFAULT_PREFIX
         self.folder = None
         self.subfolders = False
         self.file_filter = DEFAULT_FILE_FILTER
         self.files = None
+        self.workers = DEFAULT_WORKERS
+        self.timeout = DEFAULT_TIMEOUT
+        self.cache_folder = DEFAULT_CACHE_FOLDER
+        self.cache_size = DEFAULT_CACHE_SIZE
+        self.stop_on_mismatch = False
+        self.output_limit = DEFAULT_OUTPUT_LIMIT
+        self.line_limit = None
+        self.recycle_after = DEFAULT_RECYCLE_AFTER
+        self.recycle_rss = None
+        self.memory_limit = None
+        self.deduplicate = True
+        self.normalise = False
+        self.show_stats = False
+        self.measure_memory = False
+        self.reference = None
+        self.reference_results = None
+        self.efficiency_factor = DEFAULT_EFFICIENCY_FACTOR
+        self.efficiency_cost = COST_TIME
 
     def is_ready(self):
         return self.test_cases and self.files
 
     def set_test_cases_raw(self, test_cases_raw):
         self.test_cases_raw = test_cases_raw
+        self.test_cases_file = None
+        return self._parse()
+
+    def set_test_cases_file(self, filename):
+        """Load test cases from a file
+
+        Raises OSError if the file cannot be read and UnicodeDecodeError if it
+        cannot be decoded.
+        """
+        test_cases_file = TestCaseFile(filename)
+        self.test_cases_raw = None
+        self.test_cases_file = test_cases_file
         return self._parse()
 
+    def reload_test_cases(self):
+        """Load the test case file again if it has changed since it was
+        loaded, and return whether it had
+
+        Raises TestCaseFileChanged if the file can no longer be loaded, and
+        keeps the test cases as they were.
+        """
+        if not (self.test_cases_file and self.test_cases_file.changed()):
+            return False
+        filename = self.test_cases_file.filename
+        try:
+            test_cases_file = TestCaseFile(filename)
+            test_cases = test_cases_file.parse(self.prefix)
+        except TEST_CASE_ERRORS as e:
+            raise TestCaseFileChanged(
+                'Test case file has changed and could not be loaded again: {}'.format(e))
+        if not test_cases:
+            raise TestCaseFileChanged(
+                'Test case file has changed and no longer has any test cases: ' + filename)
+        self.test_cases_file = test_cases_file
+        self.test_cases = test_cases
+        return True
+
     def set_prefix(self, prefix):
         self.prefix = prefix
-        return self._parse()
+        try:
+            return self._parse()
+        except TEST_CASE_ERRORS:
+            self.test_cases_file = None
+            self.test_cases = None
+            return False
 
     def _parse(self):
-        if not self.test_cases_raw:
+        if self.test_cases_file:
+            self.test_cases = self.test_cases_file.parse(self.prefix)
+        elif self.test_cases_raw:
+            self.test_cases = parse_test_cases(self.test_cases_raw, self.prefix)
+        else:
             self.test_cases = None
             return False
-        sections = re.split(r'^' + re.escape(self.prefix) +
-                            r'[^\n]*\n', self.test_cases_raw, flags=re.MULTILINE)
-        if len(sections) < 3 or len(sections) % 2 == 0:
+        if not self.test_cases:
             self.test_cases_raw = None
+            self.test_cases_file = None
             self.test_cases = None
             return False
-        self.test_cases = []
-        for i in range(1, len(sections), 2):
-            self.test_cases.append(TestCase(sections[i], sections[i + 1]))
         return True
 
     def set_folder(self, folder):
@@ -784,6 +2484,65 @@ class AutoMarker:
         self.file_filter = file_filter
         return self._search()
 
+    def set_workers(self, workers):
+        self.workers = max(1, workers)
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+    def set_cache_folder(self, cache_folder):
+        self.cache_folder = cache_folder
+
+    def set_stop_on_mismatch(self, stop_on_mismatch):
+        self.stop_on_mismatch = stop_on_mismatch
+
+    def set_output_limit(self, output_limit):
+        self.output_limit = output_limit
+
+    def set_line_limit(self, line_limit):
+        self.line_limit = line_limit
+
+    def set_recycle_after(self, recycle_after):
+        self.recycle_after = recycle_after
+
+    def set_recycle_rss(self, recycle_rss):
+        self.recycle_rss = recycle_rss
+
+    def set_memory_limit(self, memory_limit):
+        self.memory_limit = memory_limit
+
+    def set_deduplicate(self, deduplicate):
+        self.deduplicate = deduplicate
+
+    def set_normalise(self, normalise):
+        self.normalise = normalise
+
+    def set_show_stats(self, show_stats):
+        self.show_stats = show_stats
+
+    def set_measure_memory(self, measure_memory):
+        self.measure_memory = measure_memory
+
+    def set_reference(self, filename):
+        """Compare the cost of each submission with that of a reference
+        solution, or stop comparing if filename is None
+
+        Raises OSError if the file cannot be read and SyntaxError if it
+        cannot be compiled.
+        """
+        if filename:
+            with open(filename) as f:
+                compile(f.read(), filename, 'exec')
+        self.reference = filename
+        self.reference_results = None
+
+    def set_efficiency_factor(self, efficiency_factor):
+        self.efficiency_factor = efficiency_factor
+
+    def set_efficiency_cost(self, efficiency_cost):
+        self.efficiency_cost = efficiency_cost
+        self.reference_results = None
+
     def refresh(self):
         return self._search()
 
@@ -791,52 +2550,561 @@ class AutoMarker:
         if not self.folder:
             self.files = None
             return False
-        pattern = self.folder
-        if self.subfolders:
-            pattern = path.join(pattern, '**')
-        pattern = path.join(pattern, self.file_filter)
-        self.files = glob.glob(pattern, recursive=True)
+        folder_index = None
+        index = {}
+        if self.cache_folder:
+            folder_index = FolderIndex(path.join(self.cache_folder, 'folders'), self.cache_size)
+            index = folder_index.get_index(self.folder)
+        self.files = find_files(self.folder, self.file_filter, self.subfolders, index)
         self.files.sort()
+        if folder_index:
+            folder_index.put_index(self.folder, index)
         return True
 
-    def generate_report(self, f):
-        tester = Tester(self.test_cases)
-        results = [tester.test(filename) for filename in self.files]
+    def make_tester(self):
+        """Return a ParallelTester with the current test cases and options"""
+        if self.test_cases_file and self.test_cases_file.changed():
+            raise TestCaseFileChanged('Test case file has changed since it was loaded. '
+                                      'Load it again before generating the report.')
+        bytecode_cache = result_cache = None
+        if self.cache_folder:
+            bytecode_cache = BytecodeCache(
+                path.join(self.cache_folder, 'bytecode'), self.cache_size)
+            # Times from an earlier run, under a different load, can't be
+            # compared with times from this one
+            if not (self.reference and self.efficiency_cost == COST_TIME):
+                result_cache = ResultCache(
+                    path.join(self.cache_folder, 'results'), self.cache_size)
+        return ParallelTester(self.test_cases, self.workers, timeout=self.timeout,
+                              bytecode_cache=bytecode_cache, result_cache=result_cache,
+                              stop_on_mismatch=self.stop_on_mismatch,
+                              output_limit=self.output_limit, line_limit=self.line_limit,
+                              recycle_after=self.recycle_after,
+                              recycle_rss=self.recycle_rss, memory_limit=self.memory_limit,
+                              deduplicate=self.deduplicate, normalise=self.normalise,
+                              measure_memory=self.measure_memory,
+                              count_lines=bool(self.reference) and
+                              self.efficiency_cost == COST_LINES)
+
+    def mark_reference(self):
+        """Run the test cases on the reference solution, if any, by itself
+        and keep its results as reference_results
+        """
+        self.reference_results = None
+        if not self.reference:
+            return
+        tester = self.make_tester()
+        try:
+            self._keep_reference(tester.test(self.reference))
+        finally:
+            tester.close()
+
+    def test_all(self, tester, filenames):
+        """Yield the SubmissionResult of each file from tester.test_all()
+
+        If there is a reference solution, it is marked first along with the
+        files, so that it runs under the same load as them, and its results
+        are kept as reference_results instead of being yielded or counted
+        towards progress.
+        """
+        if not self.reference:
+            yield from tester.test_all(filenames)
+            return
+        self.reference_results = None
+        progress = tester.progress
+        tester.progress = None
+        all_results = tester.test_all([self.reference] + list(filenames))
+        try:
+            self._keep_reference(next(all_results))
+            tester.progress = progress
+            yield from all_results
+        finally:
+            all_results.close()
+
+    def _keep_reference(self, reference_results):
+        """Raises ValueError if the reference solution no longer compiles"""
+        if reference_results.compile_error:
+            raise ValueError('Reference solution could not be compiled: {}'.format(
+                reference_results.compile_error))
+        self.reference_results = reference_results
+
+    def generate_report(self, f, progress=None, cancel=None, json_file=None, csv_file=None,
+                        results=None):
+        """Run the test cases on all submissions and write the report to f
+
+        If given, progress is called with the number of submissions and test
+        cases marked so far, from the thread generating the report. If the
+        threading.Event cancel is set, marking stops after the current
+        submission and the report covers only the submissions marked so far.
+
+        Results can also be written to json_file, one JSON object per
+        submission, and to csv_file, one row of marks per submission. Both
+        are written as each submission is marked.
+
+        If results are given, the report is written from these
+        SubmissionResults instead of marking the submissions.
+
+        If there is a reference solution, it is marked first (or, with
+        results given, if it has not been marked yet) and the cost of each
+        submission is compared with it.
+        """
+        test_cases = self.test_cases
+        marked_files = marked_tests = 0
+        if results is None:
+            files = self.files
+            tester = self.make_tester()
+            if progress:
+                def count_tests(count):
+                    nonlocal marked_tests
+                    marked_tests += count
+                    progress(marked_files, marked_tests)
+                tester.progress = count_tests
+            all_results = self.test_all(tester, files)
+            sections = tester.sections
+        else:
+            files = results
+            sections = SectionCache(self.output_limit)
+            if self.reference and not self.reference_results:
+                self.mark_reference()
+            all_results = (file_results for file_results in results)
+        header = ['File name'] + list(range(1, len(test_cases) + 1)) + ['Score']
+        extra_columns = 0
+        if self.show_stats:
+            header.append('Time (s)')
+            extra_columns += 1
+        if self.show_stats and self.measure_memory:
+            header.append('Memory (KB)')
+            extra_columns += 1
+        # The reference solution is marked along with the first submission
+        reference_costs = None
+        if self.reference:
+            header.extend(['Cost ratio', 'Efficient'])
+            extra_columns += 2
+        inefficient = []
+        slowest_files = []
+        slowest_tests = []
         table = Texttable()
-        table.header(['File name'] +
-                     list(range(1, len(self.test_cases) + 1)) + ['Score'])
+        table.header(header)
+        # Cells are formatted here, and as text that looks like a number
+        # Texttable would format them again, so "0.250" would become "0"
+        table.set_cols_dtype(['t'] * len(header))
+        if csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(header)
         perfects = 0
-        for file_results in results:
-            if file_results.compile_error:
-                table.add_row([file_results.filename] + ['-'] * (len(self.test_cases) + 1))
+        reused = ran = shared = 0
+        identical = {}
+        # The summary table goes first, but only its rows are kept in memory.
+        # Details are written to a spill file as each submission is marked.
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as details:
+            for file_results in all_results:
+                if self.reference and reference_costs is None:
+                    reference_costs = self._reference_costs()
+                self._write_details(details, file_results, sections)
+                marked_files += 1
+                if progress:
+                    progress(marked_files, marked_tests)
+                if file_results.compile_error:
+                    row = [file_results.filename] + ['-'] * (len(test_cases) + 1 + extra_columns)
+                    score = None
+                else:
+                    marks = [STATUS_MARKS[result.status] for result in file_results.test_results]
+                    score = sum(1 for result in file_results.test_results if result.success)
+                    if score == len(file_results.test_results):
+                        perfects += 1
+                    row = [file_results.filename] + marks + [score]
+                    if self.show_stats:
+                        row.extend(self._stats_cells(file_results.test_results))
+                        if not file_results.duplicate_of:
+                            self._add_slowest(slowest_files, slowest_tests, file_results)
+                    if reference_costs:
+                        ratios, overall, efficient = self._cost_ratios(
+                            file_results.test_results, reference_costs)
+                        row.extend(['-' if overall is None else '{:.2f}'.format(overall),
+                                    '-' if efficient is None else
+                                    'Yes' if efficient else 'No'])
+                        if efficient is False:
+                            inefficient.append((file_results.filename, ratios, overall))
+                table.add_row(row)
+                if csv_file:
+                    csv_writer.writerow(row)
+                if json_file:
+                    self._write_json(json_file, file_results, score, reference_costs)
+                if file_results.content_digest:
+                    identical.setdefault(file_results.content_digest, []).append(
+                        file_results.filename)
+                if file_results.duplicate_of and not file_results.compile_error:
+                    shared += len(file_results.test_results)
+                elif not file_results.compile_error:
+                    cached = sum(1 for result in file_results.test_results if result.cached)
+                    reused += cached
+                    ran += len(file_results.test_results) - cached
+                if cancel and cancel.is_set():
+                    break
+            all_results.close()
+            table.draw_to(f)
+            f.write('\n')
+            if marked_files < len(files):
+                f.write(REPORT_CANCELLED.format(marked_files, len(files)) + '\n\n')
+            if self.cache_folder:
+                f.write(REPORT_CACHE_STATUS.format(reused, ran) + '\n\n')
+            if shared:
+                f.write(REPORT_SHARED.format(shared) + '\n\n')
+            if reference_costs:
+                self._write_inefficient(f, inefficient, reference_costs)
+            self._write_identical(f, identical)
+            if self.show_stats:
+                self._write_slowest(f, slowest_files, slowest_tests)
+            details.seek(0)
+            shutil.copyfileobj(details, f)
+        return perfects
+
+    def _cost(self, result):
+        if self.efficiency_cost == COST_LINES:
+            return result.lines
+        return result.wall_time
+
+    def _reference_costs(self):
+        """Return the reference solution's cost of each test case, or None
+        for the test cases it failed
+        """
+        return [self._cost(result) if result.success else None
+                for result in self.reference_results.test_results]
+
+    def _limit_cost(self, result):
+        """Return the cost of the limit that stopped a test, if it is the
+        cost being compared
+        """
+        if result.status == TIMED_OUT and self.efficiency_cost == COST_TIME:
+            return self.timeout
+        if result.status == LINE_LIMIT_EXCEEDED and self.efficiency_cost == COST_LINES:
+            return self.line_limit
+        return None
+
+    def _cost_ratios(self, test_results, reference_costs):
+        """Return the ratio of a submission's cost to the reference
+        solution's for each test case and overall, and whether it is efficient
+
+        The test cases that the submission passed count towards the overall
+        ratio, and so do those it was stopped on for timing out or running
+        too many lines, at no less than the limit's cost. Other failures
+        don't count, since a program that stops early would otherwise look
+        efficient. A submission that was stopped is never efficient. Ratios
+        are None where there is nothing to compare, and efficient is None if
+        the overall ratio is and the submission was not stopped.
+        """
+        ratios = []
+        total = reference_total = 0
+        stopped = False
+        for result, reference_cost in zip(test_results, reference_costs):
+            cost = self._cost(result)
+            counted = result.success
+            if result.status in (TIMED_OUT, LINE_LIMIT_EXCEEDED):
+                stopped = counted = True
+                limit = self._limit_cost(result)
+                if limit is not None:
+                    cost = max(cost or 0, limit)
+            if cost is None or not reference_cost:
+                ratios.append(None)
                 continue
-            successes = [1 if result.success else 0 for result in file_results.test_results]
-            score = sum(successes)
-            if score == len(file_results.test_results):
-                perfects += 1
-            table.add_row([file_results.filename] + successes + [score])
-        f.write(table.draw() + '\n\n')
-        for file_results in results:
-            f.write(file_results.filename + '\n')
-            if file_results.compile_error:
-                f.write('Syntax error: ' + str(file_results.compile_error) + '\n\n')
+            ratios.append(cost / reference_cost)
+            if counted:
+                total += cost
+                reference_total += reference_cost
+        overall = total / reference_total if reference_total else None
+        if stopped:
+            return ratios, overall, False
+        return ratios, overall, None if overall is None else overall <= self.efficiency_factor
+
+    def _write_inefficient(self, f, inefficient, reference_costs):
+        failed = [str(i + 1) for i, cost in enumerate(reference_costs) if cost is None]
+        if failed:
+            f.write(REPORT_REFERENCE_FAILED.format(', '.join(failed)) + '\n\n')
+        f.write(REPORT_EFFICIENCY.format(
+            COST_NAMES[self.efficiency_cost], self.reference, len(inefficient),
+            self.efficiency_factor) + '\n\n')
+        if not inefficient:
+            return
+        table = Texttable()
+        table.header([REPORT_INEFFICIENT] + list(range(1, len(reference_costs) + 1)) +
+                     ['Overall'])
+        table.set_cols_dtype(['t'] * (len(reference_costs) + 2))
+        for filename, ratios, overall in inefficient:
+            table.add_row([filename] + ['-' if ratio is None else '{:.2f}'.format(ratio)
+                                        for ratio in ratios] +
+                          ['-' if overall is None else '{:.2f}'.format(overall)])
+        table.draw_to(f)
+        f.write('\n')
+
+    def _stats_cells(self, test_results):
+        """Return the summary table cells of a submission's total time and
+        peak memory
+        """
+        wall_time = sum(result.wall_time or 0 for result in test_results)
+        cells = ['{:.3f}'.format(wall_time)]
+        if self.measure_memory:
+            memories = [result.peak_memory for result in test_results
+                        if result.peak_memory is not None]
+            cells.append('{:.0f}'.format(max(memories) / 1024) if memories else '-')
+        return cells
+
+    @staticmethod
+    def _add_slowest(slowest_files, slowest_tests, file_results):
+        """Keep the REPORT_SLOWEST slowest submissions and test cases in heaps"""
+        total = 0
+        for i, result in enumerate(file_results.test_results):
+            if result.wall_time is None:
                 continue
-            table = Texttable()
-            table.header(['Failed Test Case', 'Input',
-                          'Expected Output', 'Actual Output'])
-            rows = 0
-            for i in range(len(file_results.test_results)):
-                result = file_results.test_results[i]
-                if result.success:
-                    continue
-                table.add_row([i + 1, result.test_case.test_input,
-                               result.test_case.expected_output, result.output])
-                rows += 1
-            if rows == 0:
-                f.write('No failed test cases\n\n')
+            total += result.wall_time
+            item = (result.wall_time, file_results.filename, i + 1)
+            if len(slowest_tests) < REPORT_SLOWEST:
+                heapq.heappush(slowest_tests, item)
+            else:
+                heapq.heappushpop(slowest_tests, item)
+        item = (total, file_results.filename)
+        if len(slowest_files) < REPORT_SLOWEST:
+            heapq.heappush(slowest_files, item)
+        else:
+            heapq.heappushpop(slowest_files, item)
+
+    def _write_slowest(self, f, slowest_files, slowest_tests):
+        if not slowest_files:
+            return
+        table = Texttable()
+        table.header([REPORT_SLOWEST_SUBMISSIONS, 'Time (s)'])
+        table.set_cols_dtype(['t', 't'])
+        for total, filename in sorted(slowest_files, reverse=True):
+            table.add_row([filename, '{:.3f}'.format(total)])
+        table.draw_to(f)
+        f.write('\n')
+        if not slowest_tests:
+            return
+        table = Texttable()
+        table.header([REPORT_SLOWEST_TEST_CASES, 'Test Case', 'Time (s)'])
+        table.set_cols_dtype(['t', 't', 't'])
+        for wall_time, filename, index in sorted(slowest_tests, reverse=True):
+            table.add_row([filename, index, '{:.3f}'.format(wall_time)])
+        table.draw_to(f)
+        f.write('\n')
+
+    def _write_identical(self, f, identical):
+        groups = [filenames for filenames in identical.values() if len(filenames) > 1]
+        if not groups:
+            return
+        groups.sort(key=lambda filenames: (-len(filenames), filenames[0]))
+        table = Texttable()
+        table.header(['Copies', REPORT_IDENTICAL])
+        table.set_cols_dtype(['t', 't'])
+        for filenames in groups:
+            table.add_row([len(filenames), '\n'.join(filenames)])
+        table.draw_to(f)
+        f.write('\n')
+
+    def _write_json(self, f, file_results, score, reference_costs=None):
+        record = {
+            'filename': file_results.filename,
+            'score': score,
+            'total': len(self.test_cases),
+            'compile_error': None,
+            'duplicate_of': file_results.duplicate_of,
+            'test_results': []
+        }
+        ratios = None
+        if reference_costs:
+            record['cost_ratio'] = record['efficient'] = None
+            if not file_results.compile_error:
+                ratios, record['cost_ratio'], record['efficient'] = self._cost_ratios(
+                    file_results.test_results, reference_costs)
+        if file_results.compile_error:
+            record['compile_error'] = str(file_results.compile_error)
+        else:
+            for i, result in enumerate(file_results.test_results):
+                record['test_results'].append({
+                    'test_case': i + 1,
+                    'status': result.status,
+                    'success': result.success,
+                    'output': result.output[:EXPORT_OUTPUT_LIMIT],
+                    'output_truncated': len(result.output) > EXPORT_OUTPUT_LIMIT,
+                    'output_size': result.output_size,
+                    'wall_time': result.wall_time,
+                    'cpu_time': result.cpu_time,
+                    'peak_memory': result.peak_memory,
+                    'lines': result.lines,
+                    'cached': result.cached
+                })
+                if ratios:
+                    record['test_results'][-1]['cost_ratio'] = ratios[i]
+        f.write(json.dumps(record) + '\n')
+
+    def _write_details(self, f, file_results, sections):
+        f.write(file_results.filename + '\n')
+        if isinstance(file_results.compile_error, SyntaxError):
+            f.write('Syntax error: ' + str(file_results.compile_error) + '\n\n')
+            return
+        if file_results.compile_error:
+            f.write('Could not be read: ' + str(file_results.compile_error) + '\n\n')
+            return
+        table = Texttable()
+        header = ['Failed Test Case', 'Input', 'Expected Output', 'Actual Output']
+        if self.show_stats:
+            header.extend(['Time (s)', 'CPU (s)'])
+        if self.show_stats and self.measure_memory:
+            header.append('Memory (KB)')
+        table.header(header)
+        # Outputs like "007" or "0.50" are shown as they were printed
+        table.set_cols_dtype(['t'] * len(header))
+        rows = 0
+        for i in range(len(file_results.test_results)):
+            result = file_results.test_results[i]
+            if result.success:
                 continue
-            f.write(table.draw() + '\n\n')
-        return perfects
+            output = result.output
+            try:
+                test_input, expected_output = sections.display(result.test_case)
+                if result.status == OUTPUT_LIMIT_EXCEEDED:
+                    output += OUTPUT_LIMIT_NOTE.format(
+                        result.output_size, sections.expected_output(result.test_case)[1])
+            except TEST_CASE_ERRORS as e:
+                test_input, expected_output = 'Could not be read: {}'.format(e), ''
+            if result.status == LINE_LIMIT_EXCEEDED:
+                output += LINE_LIMIT_NOTE.format(self.line_limit)
+            row = [i + 1, test_input, expected_output, output]
+            if self.show_stats:
+                row.extend('-' if value is None else '{:.3f}'.format(value)
+                           for value in (result.wall_time, result.cpu_time))
+            if self.show_stats and self.measure_memory:
+                row.append('-' if result.peak_memory is None
+                           else '{:.0f}'.format(result.peak_memory / 1024))
+            table.add_row(row)
+            rows += 1
+        if rows == 0:
+            f.write('No failed test cases\n\n')
+            return
+        table.draw_to(f)
+        f.write('\n')
+
+class Watcher:
+    """Marks submissions, then marks them again as they are added or changed
+
+    Each poll searches the folder again, which only lists folders that have
+    changed, and stats the submissions. Only the submissions that are new or
+    whose size or modification time changed are marked again. The results of
+    all submissions are kept so that the report can be written again at any
+    time.
+    """
+
+    def __init__(self, automarker):
+        self.automarker = automarker
+        self.results = {}
+        self._stats = {}
+        self._index = {}
+
+    def poll(self, progress=None, cancel=None):
+        """Mark new and changed submissions and forget removed ones
+
+        Returns the file names marked and removed. progress and cancel are as
+        for AutoMarker.generate_report(). If the test case file has changed,
+        it is loaded again and all submissions are marked again. Raises
+        TestCaseFileChanged if it can't be loaded.
+        """
+        automarker = self.automarker
+        if automarker.reload_test_cases():
+            # Results for the old test cases can't go in the same report
+            self.results.clear()
+            self._stats.clear()
+        stats = {}
+        for filename in find_files(automarker.folder, automarker.file_filter,
+                                   automarker.subfolders, self._index):
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            stats[filename] = (stat.st_size, stat.st_mtime_ns)
+        removed = [filename for filename in self._stats if filename not in stats]
+        for filename in removed:
+            del self._stats[filename]
+            del self.results[filename]
+        changed = sorted(filename for filename in stats
+                         if self._stats.get(filename) != stats[filename])
+        if not changed:
+            return changed, removed
+        tester = automarker.make_tester()
+        marked_files = marked_tests = 0
+        if progress:
+            def count_tests(count):
+                nonlocal marked_tests
+                marked_tests += count
+                progress(marked_files, marked_tests)
+            tester.progress = count_tests
+        marked = []
+        # Submissions are compared with the reference solution as marked
+        # along with them
+        all_results = automarker.test_all(tester, changed)
+        for file_results in all_results:
+            if isinstance(file_results.compile_error, OSError):
+                # Gone since the search, or in the middle of being replaced,
+                # so leave it out until the next poll finds it again
+                if self.results.pop(file_results.filename, None):
+                    removed.append(file_results.filename)
+                self._stats.pop(file_results.filename, None)
+            else:
+                # The stat from before marking, so a change while marking is
+                # picked up by the next poll
+                self._stats[file_results.filename] = stats[file_results.filename]
+                self.results[file_results.filename] = file_results
+                marked.append(file_results.filename)
+            marked_files += 1
+            if progress:
+                progress(marked_files, marked_tests)
+            if cancel and cancel.is_set():
+                break
+        all_results.close()
+        return marked, removed
+
+    def perfects(self):
+        return sum(1 for file_results in self.results.values()
+                   if not file_results.compile_error and
+                   all(result.success for result in file_results.test_results))
+
+    def write_report(self, filename, json_filename=None, csv_filename=None):
+        """Write the report and any exports of all results so far, replacing
+        the files
+        """
+        results = [self.results[filename] for filename in sorted(self.results)]
+        with contextlib.ExitStack() as stack:
+            f = stack.enter_context(open(filename, 'w'))
+            json_file = csv_file = None
+            if json_filename:
+                json_file = stack.enter_context(open(json_filename, 'w', encoding='utf-8'))
+            if csv_filename:
+                csv_file = stack.enter_context(
+                    open(csv_filename, 'w', encoding='utf-8', newline=''))
+            return self.automarker.generate_report(
+                f, json_file=json_file, csv_file=csv_file, results=results)
+
+    def watch(self, callback, cancel, interval=WATCH_INTERVAL, error=None):
+        """Poll every interval seconds until cancel is set, calling callback
+        with the file names marked and removed whenever there are any
+
+        If error is given, it is called with the TestCaseFileChanged raised
+        by a poll, once until the error changes, and polling carries on so
+        that the test case file can be fixed. Otherwise the error is raised.
+        """
+        last_error = None
+        while not cancel.wait(interval):
+            try:
+                marked, removed = self.poll(cancel=cancel)
+            except TestCaseFileChanged as e:
+                if not error:
+                    raise
+                if str(e) != last_error:
+                    last_error = str(e)
+                    error(e)
+                continue
+            last_error = None
+            if marked or removed:
+                callback(marked, removed)
+
 
 class Gui:
 
@@ -844,6 +3112,8 @@ class Gui:
         self.automarker = automarker
         self.current_test_case = None
         self.current_submission = None
+        self.report_cancel_event = None
+        self.report_queue = None
         self.make_widgets()
         self.layout_widgets()
         self.sync_test_cases()
@@ -966,7 +3236,13 @@ class Gui:
         self.report = ttk.Frame(self.main)
         self.report_generate = ttk.Button(
             self.report, text='Run Test Cases and Save Report As...', command=self.generate_report)
+        self.report_watch_var = tk.StringVar(value='False')
+        self.report_watch = ttk.Checkbutton(
+            self.report, text='Watch for changes', variable=self.report_watch_var, onvalue='True', offvalue='False')
         self.report_status = ttk.Label(self.report)
+        self.report_cancel = ttk.Button(
+            self.report, text='Cancel', command=self.cancel_report, state='disabled')
+        self.report_progress = ttk.Progressbar(self.report, mode='determinate')
 
     def layout_widgets(self):
         common_kwargs = {
@@ -1075,10 +3351,16 @@ class Gui:
         self.submissions.rowconfigure(2, weight=1)
 
         self.report_generate.grid(column=0, row=0, **common_kwargs)
-        self.report_status.grid(column=1, row=0, **common_kwargs)
+        self.report_watch.grid(column=1, row=0, **common_kwargs)
+        self.report_status.grid(column=2, row=0, **common_kwargs)
+        self.report_cancel.grid(column=3, row=0, **common_kwargs)
+        self.report_progress.grid(column=0, columnspan=4, row=1, **common_kwargs)
         self.report.columnconfigure(0, weight=0)
-        self.report.columnconfigure(1, weight=1)
+        self.report.columnconfigure(1, weight=0)
+        self.report.columnconfigure(2, weight=1)
+        self.report.columnconfigure(3, weight=0)
         self.report.rowconfigure(0, weight=0)
+        self.report.rowconfigure(1, weight=0)
 
         self.instructions.grid(column=0, row=0, rowspan=3,
                                ipadx=PADX, ipady=PADY, **common_kwargs)
@@ -1108,12 +3390,11 @@ class Gui:
             return
         filename = path.abspath(filename)
         try:
-            with open(filename) as f:
-                test_cases_raw = f.read()
-        except OSError as e:
+            loaded = self.automarker.set_test_cases_file(filename)
+        except (OSError, UnicodeDecodeError) as e:
             mb.showerror('Error', 'Error loading test cases:\n\n' + str(e))
             return
-        if self.automarker.set_test_cases_raw(test_cases_raw):
+        if loaded:
             mb.showinfo('Success', '{} test case(s) successfully loaded.'.format(
                 len(self.automarker.test_cases)))
             self.current_test_case = 0
@@ -1203,11 +3484,142 @@ class Gui:
         _, extension = path.splitext(filename)
         if not extension and not path.exists(filename + '.txt'):
             filename += '.txt'
-        with open(filename, 'w') as f:
-            perfects = self.automarker.generate_report(f)
-        mb.showinfo('Success', '{} out of {} submissions passed all test cases.'.format(perfects, len(self.automarker.files)))
+        try:
+            f = open(filename, 'w')
+        except OSError as e:
+            mb.showerror('Error', 'Error saving report:\n\n' + str(e))
+            return
+        # Marking runs in a background thread so that the window stays
+        # responsive. Tk must only be used from this thread, so the background
+        # thread passes progress back through a queue that is polled with
+        # after().
+        self.report_cancel_event = threading.Event()
+        self.report_queue = queue.Queue()
+        self.report_started = time.perf_counter()
+        self.report_marked = 0
+        self.report_progress.config(
+            maximum=len(self.automarker.files) * len(self.automarker.test_cases), value=0)
+        self._set_marking(True)
+        if self.report_watch_var.get() == 'True':
+            f.close()
+            threading.Thread(target=self._watch_report, args=(filename,), daemon=True).start()
+        else:
+            threading.Thread(target=self._generate_report, args=(f,), daemon=True).start()
+        self.root.after(REPORT_PROGRESS_INTERVAL, self.poll_report)
+
+    def _generate_report(self, f):
+        def progress(files, tests):
+            self.report_queue.put(('progress', files, tests))
+        try:
+            with f:
+                perfects = self.automarker.generate_report(
+                    f, progress=progress, cancel=self.report_cancel_event)
+            self.report_queue.put(('done', perfects, f.name))
+        except Exception as e:
+            self.report_queue.put(('error', e))
+
+    def _watch_report(self, filename):
+        def progress(files, tests):
+            self.report_queue.put(('progress', files, tests))
+
+        def update(marked, removed):
+            perfects = watcher.write_report(filename)
+            self.report_queue.put(('watching', perfects, len(watcher.results), None))
+
+        def error(e):
+            self.report_queue.put(('watch_error', e))
+        try:
+            watcher = Watcher(self.automarker)
+            watcher.poll(progress, self.report_cancel_event)
+            perfects = watcher.write_report(filename)
+            self.report_queue.put(('watching', perfects, len(watcher.results), filename))
+            watcher.watch(update, self.report_cancel_event, error=error)
+            self.report_queue.put(('stopped',))
+        except Exception as e:
+            self.report_queue.put(('error', e))
+
+    def poll_report(self):
+        progress = watching = watch_error = done = None
+        while True:
+            try:
+                message = self.report_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'progress':
+                progress = message[1:]
+            elif message[0] == 'watching':
+                watching = message[1:]
+                watch_error = None
+            elif message[0] == 'watch_error':
+                watch_error = message[1]
+            else:
+                done = message
+        if progress:
+            self._show_progress(*progress)
+        if watching:
+            self._show_watching(*watching)
+        if watch_error and not self.report_cancel_event.is_set():
+            self.report_status.config(text=REPORT_WATCH_ERROR.format(
+                time.strftime('%H:%M:%S'), watch_error))
+        if not done:
+            self.root.after(REPORT_PROGRESS_INTERVAL, self.poll_report)
+            return
+        self._set_marking(False)
+        if done[0] == 'error':
+            mb.showerror('Error', 'Error generating report:\n\n' + str(done[1]))
+            return
+        if done[0] == 'stopped':
+            return
+        _, perfects, filename = done
+        files = len(self.automarker.files)
+        if self.report_marked < files:
+            mb.showinfo('Cancelled', REPORT_CANCELLED.format(self.report_marked, files) +
+                        '.\n\n' + REPORT_SUMMARY.format(perfects, self.report_marked))
+        else:
+            mb.showinfo('Success', REPORT_SUMMARY.format(perfects, files))
         if hasattr(os, 'startfile'):
-            os.startfile(f.name)
+            os.startfile(filename)
+
+    def _show_watching(self, perfects, files, filename):
+        self.report_progress.config(value=self.report_progress.cget('maximum'))
+        if not self.report_cancel_event.is_set():
+            self.report_status.config(text=REPORT_WATCHING.format(
+                time.strftime('%H:%M:%S'), perfects, files))
+        if filename and hasattr(os, 'startfile'):
+            os.startfile(filename)
+
+    def cancel_report(self):
+        self.report_cancel_event.set()
+        self.report_cancel.config(state='disabled')
+        self.report_status.config(text=REPORT_PROGRESS_CANCELLING)
+
+    def _show_progress(self, files, tests):
+        self.report_marked = files
+        self.report_progress.config(value=tests)
+        if self.report_cancel_event.is_set():
+            return
+        total_files = len(self.automarker.files)
+        total_tests = total_files * len(self.automarker.test_cases)
+        rate = tests / max(time.perf_counter() - self.report_started, 1e-6)
+        left = int((total_tests - tests) / rate) if rate else 0
+        self.report_status.config(text=REPORT_PROGRESS.format(
+            files, total_files, tests, total_tests, rate,
+            '{}:{:02d}:{:02d}'.format(left // 3600, left // 60 % 60, left % 60)))
+
+    def _set_marking(self, marking):
+        """Disable changes to test cases and submissions while marking"""
+        state = 'disabled' if marking else 'normal'
+        for widget in (self.test_cases_load, self.test_cases_change,
+                       self.submissions_choose, self.submissions_subfolders,
+                       self.submissions_refresh, self.submissions_change,
+                       self.report_generate, self.report_watch):
+            widget.config(state=state)
+        self.report_cancel.config(state='normal' if marking else 'disabled')
+        if not marking:
+            self.report_progress.config(value=0)
+            self.submissions_refresh.config(
+                state='normal' if self.automarker.folder else 'disabled')
+            self.sync_report()
 
     def _set_readonly_text(self, widget, text):
         widget.config(state='normal')
@@ -1231,6 +3643,10 @@ class Gui:
         if self.current_test_case >= length:
             self.current_test_case = length - 1
         current = self.automarker.test_cases[self.current_test_case]
+        try:
+            test_input, expected_output = current.display_input(), current.display_output()
+        except TEST_CASE_ERRORS as e:
+            test_input, expected_output = str(e), ''
         self.test_cases_status.config(text=TEST_CASES_STATUS.format(length))
         self.test_cases_prev.config(
             state='normal' if self.current_test_case > 0 else 'disabled')
@@ -1238,9 +3654,8 @@ class Gui:
             self.current_test_case + 1, length))
         self.test_cases_next.config(
             state='normal' if self.current_test_case < length - 1 else 'disabled')
-        self._set_readonly_text(self.test_cases_input, current.test_input)
-        self._set_readonly_text(self.test_cases_output,
-                                current.expected_output)
+        self._set_readonly_text(self.test_cases_input, test_input)
+        self._set_readonly_text(self.test_cases_output, expected_output)
 
     def sync_submissions(self):
         self.submissions_folder.config(
@@ -1271,6 +3686,211 @@ class Gui:
             len(self.automarker.test_cases), len(self.automarker.files)))
 
 
-app = AutoMarker()
-gui = Gui(app)
-gui.run()
+def run_gui():
+    # tkinter is only imported for the GUI, so that the automarker can run
+    # headless and be imported without a display
+    global tk, ttk, fd, sd, mb, st
+    import tkinter as tk
+    from tkinter import ttk
+    from tkinter import filedialog as fd
+    from tkinter import simpledialog as sd
+    from tkinter import messagebox as mb
+    from tkinter import scrolledtext as st
+    app = AutoMarker()
+    gui = Gui(app)
+    gui.run()
+
+
+def main(argv=None):
+    """Run the automarker from the command line
+
+    Returns 0 if every submission passed all test cases, 1 if any did not and
+    2 if the report could not be generated.
+    """
+    parser = argparse.ArgumentParser(
+        description='Run test cases on multiple Python programs and generate a summary '
+                    'report. Run without arguments to use the GUI instead.')
+    parser.add_argument('test_cases', nargs='?',
+                        help='.txt file containing test cases')
+    parser.add_argument('folder', nargs='?', help="programs' location")
+    parser.add_argument('-o', '--output',
+                        help='save the report as this file instead of printing it')
+    parser.add_argument('--json', metavar='FILE', dest='json_output',
+                        help='also save the results as JSON Lines, one submission per line')
+    parser.add_argument('--csv', metavar='FILE', dest='csv_output',
+                        help='also save the marks as a CSV file, one submission per row')
+    parser.add_argument('-p', '--prefix', default=DEFAULT_PREFIX,
+                        help='prefix of section header lines (default: %(default)s)')
+    parser.add_argument('-f', '--filter', default=DEFAULT_FILE_FILTER, dest='file_filter',
+                        help='file names of programs (default: %(default)s)')
+    parser.add_argument('-s', '--subfolders', action='store_true',
+                        help='include subfolders')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help='number of test cases to run at once (default: %(default)s)')
+    parser.add_argument('-t', '--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='time limit for each test case in seconds, or 0 to run '
+                             'test cases without one, in this process or, with more than '
+                             'one worker, in worker processes (default: %(default)s)')
+    parser.add_argument('--output-limit', type=int, default=DEFAULT_OUTPUT_LIMIT,
+                        help='most bytes of output for each test case, raised for test '
+                             'cases whose expected output is larger, or 0 for no limit '
+                             '(default: %(default)s)')
+    parser.add_argument('--line-limit', type=int, default=0,
+                        help='most lines each test case may run, which stops runaway '
+                             'programs at the same point on any computer but slows '
+                             'programs down, or 0 for no limit (default: %(default)s)')
+    parser.add_argument('--recycle-after', type=int, default=DEFAULT_RECYCLE_AFTER,
+                        help='replace each process that runs programs after this many '
+                             'submissions, or 0 to keep it (default: %(default)s)')
+    parser.add_argument('--recycle-memory', type=int, default=0, metavar='MB',
+                        help='also replace a process that runs programs once it uses more '
+                             'than this much memory, or 0 not to (default: %(default)s)')
+    parser.add_argument('--memory-limit', type=int, default=0, metavar='MB',
+                        help='most memory that each process that runs programs may use, '
+                             'where supported, or 0 for no limit (default: %(default)s). '
+                             'This and the options above only apply with a time limit')
+    parser.add_argument('--no-deduplicate', action='store_true',
+                        help='mark identical programs separately instead of once')
+    parser.add_argument('--normalise', action='store_true',
+                        help='also mark programs that only differ in comments, formatting '
+                             'or docstrings once')
+    parser.add_argument('--stats', action='store_true',
+                        help='show the time taken by each program and test case in the '
+                             'report, with the slowest ones')
+    parser.add_argument('--memory', action='store_true',
+                        help='also measure the peak memory used by each test case, which '
+                             'slows programs down (shown with --stats)')
+    parser.add_argument('--reference', metavar='FILE',
+                        help='compare the cost of each program with this reference solution')
+    parser.add_argument('--cost', choices=sorted(COST_NAMES), default=COST_TIME,
+                        help='cost to compare with the reference solution: wall time or '
+                             'lines run, which is the same on any computer but slows '
+                             'programs down (default: %(default)s)')
+    parser.add_argument('--efficiency-factor', type=float, default=DEFAULT_EFFICIENCY_FACTOR,
+                        help='list programs that cost more than this many times the '
+                             'reference solution (default: %(default)s)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and mark submissions again as they are added or '
+                             'changed, updating the report (requires -o)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not cache compiled programs and test case results')
+    parser.add_argument('--stop-on-mismatch', action='store_true',
+                        help='stop each program as soon as its output differs from the '
+                             'expected output')
+    args = parser.parse_args(argv)
+    if args.test_cases is None:
+        run_gui()
+        return 0
+    if args.folder is None:
+        parser.error('the following arguments are required: folder')
+    if not re.match(VALID_FILE_FILTER_REGEX, args.file_filter):
+        parser.error('invalid filter: ' + args.file_filter)
+    if args.watch and not args.output:
+        parser.error('--watch requires -o/--output')
+
+    app = AutoMarker()
+    app.set_prefix(args.prefix)
+    try:
+        loaded = app.set_test_cases_file(args.test_cases)
+    except (OSError, UnicodeDecodeError) as e:
+        parser.exit(2, 'Error loading test cases: {}\n'.format(e))
+    if not loaded:
+        parser.exit(2, 'Invalid test cases. Check that the prefix is set correctly.\n')
+    if not path.isdir(args.folder):
+        parser.exit(2, 'Folder not found: {}\n'.format(args.folder))
+    if args.no_cache:
+        app.set_cache_folder(None)
+    app.set_subfolders(args.subfolders)
+    app.set_file_filter(args.file_filter)
+    app.set_folder(args.folder)
+    if not app.files:
+        parser.exit(2, SUBMISSIONS_STATUS_NONE + '\n')
+    app.set_workers(args.workers)
+    if not args.timeout:
+        app.set_timeout(None)
+    elif args.timeout != DEFAULT_TIMEOUT:
+        app.set_timeout(args.timeout)
+    if args.stop_on_mismatch:
+        app.set_stop_on_mismatch(True)
+    if args.no_deduplicate:
+        app.set_deduplicate(False)
+    if args.normalise:
+        app.set_normalise(True)
+    if args.stats:
+        app.set_show_stats(True)
+    if args.memory:
+        app.set_measure_memory(True)
+    if args.output_limit != DEFAULT_OUTPUT_LIMIT:
+        app.set_output_limit(args.output_limit or None)
+    if args.line_limit:
+        app.set_line_limit(args.line_limit)
+    if args.recycle_after != DEFAULT_RECYCLE_AFTER:
+        app.set_recycle_after(args.recycle_after or None)
+    if args.recycle_memory:
+        app.set_recycle_rss(args.recycle_memory * 1024 * 1024)
+    if args.memory_limit:
+        app.set_memory_limit(args.memory_limit * 1024 * 1024)
+    if args.reference:
+        try:
+            app.set_reference(args.reference)
+        except (OSError, SyntaxError, UnicodeDecodeError) as e:
+            parser.exit(2, 'Error loading reference solution: {}\n'.format(e))
+        app.set_efficiency_cost(args.cost)
+        app.set_efficiency_factor(args.efficiency_factor)
+
+    if args.watch:
+        return watch(app, args)
+    with contextlib.ExitStack() as stack:
+        try:
+            f = stack.enter_context(open(args.output, 'w')) if args.output else sys.stdout
+            json_file = csv_file = None
+            if args.json_output:
+                json_file = stack.enter_context(
+                    open(args.json_output, 'w', encoding='utf-8'))
+            if args.csv_output:
+                csv_file = stack.enter_context(
+                    open(args.csv_output, 'w', encoding='utf-8', newline=''))
+        except OSError as e:
+            parser.exit(2, 'Error saving report: {}\n'.format(e))
+        try:
+            perfects = app.generate_report(f, json_file=json_file, csv_file=csv_file)
+        except Exception as e:
+            parser.exit(2, 'Error generating report: {}\n'.format(e))
+    print(REPORT_SUMMARY.format(perfects, len(app.files)), file=sys.stderr)
+    return 0 if perfects == len(app.files) else 1
+
+
+def watch(app, args):
+    """Mark all submissions, then keep marking them again as they change
+    until interrupted with Ctrl+C
+    """
+    watcher = Watcher(app)
+
+    def update(marked, removed):
+        perfects = watcher.write_report(args.output, args.json_output, args.csv_output)
+        print(REPORT_WATCH_MARKED.format(time.strftime('%H:%M:%S'), len(marked), len(removed),
+                                         perfects, len(watcher.results)), file=sys.stderr)
+
+    def error(e):
+        print('{}: {}'.format(time.strftime('%H:%M:%S'), e), file=sys.stderr)
+    try:
+        watcher.poll()
+        perfects = watcher.write_report(args.output, args.json_output, args.csv_output)
+        print(REPORT_SUMMARY.format(perfects, len(watcher.results)), file=sys.stderr)
+        watcher.watch(update, threading.Event(), error=error)
+    except TestCaseFileChanged as e:
+        print('Error loading test cases: {}'.format(e), file=sys.stderr)
+        return 2
+    except OSError as e:
+        print('Error saving report: {}'.format(e), file=sys.stderr)
+        return 2
+    except Exception as e:
+        print('Error generating report: {}'.format(e), file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        pass
+    return 0 if watcher.perfects() == len(watcher.results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
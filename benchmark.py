@@ -0,0 +1,729 @@
+# Benchmarks for automarker
+#
+# Usage: python benchmark.py <benchmark> [options]
+# Run "python benchmark.py --help" for the list of benchmarks.
+
+from os import path
+from unittest import mock
+import argparse
+import glob
+import subprocess
+import tracemalloc
+import builtins
+import timeit
+import random
+import json
+import sys
+import shutil
+import tempfile
+import time
+import io
+import os
+
+import automarker
+
+HERE = path.dirname(path.abspath(__file__))
+TEST2 = path.join(HERE, 'test2')
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def peak_memory(fn, *args, **kwargs):
+    """Return the peak memory allocated while running fn"""
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def make_test2_cohort(folder, copies):
+    """Replicate the test2 student folders until there are 4 * copies students"""
+    students = [name for name in sorted(os.listdir(TEST2))
+                if path.isdir(path.join(TEST2, name))]
+    for i in range(copies):
+        for student in students:
+            shutil.copytree(path.join(TEST2, student),
+                            path.join(folder, '{}_{:04d}'.format(student, i)))
+
+
+def load_automarker(test_cases, folder, file_filter, workers):
+    app = automarker.AutoMarker()
+    with open(test_cases) as f:
+        app.set_test_cases_raw(f.read())
+    app.set_folder(folder)
+    app.set_subfolders(True)
+    app.set_file_filter(file_filter)
+    app.set_workers(workers)
+    app.set_cache_folder(None)
+    # The cohort is made of copies, which would otherwise only be marked once
+    app.set_deduplicate(False)
+    return app
+
+
+def bench_parallel(args):
+    workers = [n for n in sorted({1, 2, 4, args.workers}) if n <= args.workers]
+    with tempfile.TemporaryDirectory() as folder:
+        make_test2_cohort(folder, args.copies)
+        for problem in ('hen1', 'hen2', 'hen3'):
+            test_cases = path.join(TEST2, problem + '_test_cases.txt')
+            file_filter = problem.upper() + '_*.py'
+            baseline = None
+            reports = set()
+            for n in workers:
+                app = load_automarker(test_cases, folder, file_filter, n)
+                f = io.StringIO()
+                elapsed, _ = timed(app.generate_report, f)
+                reports.add(f.getvalue())
+                baseline = baseline or elapsed
+                print('{:5} {:4} submission(s) x {:2} test case(s), {:2} worker(s): '
+                      '{:7.3f}s  speedup {:5.2f}x'.format(
+                          problem, len(app.files), len(app.test_cases), n,
+                          elapsed, baseline / elapsed))
+            if len(reports) != 1:
+                print('{:5} WARNING: reports differ between worker counts'.format(problem))
+
+
+class MockExecutor(automarker.Executor):
+    """Executor with the input() and print() of automarker 0.2.2"""
+
+    def _input(self, prompt=None):
+        with mock.patch('sys.stdin', new=self._in):
+            return input()
+
+    def _print(self, *args, **kwargs):
+        with mock.patch('sys.stdout', new=self._out):
+            return print(*args, **kwargs)
+
+
+class LegacyExecutor(automarker.Executor):
+    """Executor with the setup of automarker 0.2.2"""
+
+    def __init__(self, filename, bytecode, test_input):
+        self._bytecode = bytecode
+        self._in = io.StringIO(test_input)
+        self._out = io.StringIO()
+        self._scope = automarker.BASE_SCOPE.copy()
+        self._scope['__file__'] = filename
+        self._scope['__builtins__'] = builtins.__dict__.copy()
+        self._scope['__builtins__']['input'] = self._input
+        self._scope['__builtins__']['print'] = self._print
+
+
+def bench_executor(args):
+    bytecode = compile('pass', 'empty.py', 'exec')
+    times = {}
+    for executor_class in (LegacyExecutor, automarker.Executor):
+        times[executor_class] = timeit.timeit(
+            lambda: executor_class('empty.py', bytecode, '1\n2\n'),
+            number=args.calls) / args.calls
+    before, after = times[LegacyExecutor], times[automarker.Executor]
+    print('Executor() x {}: legacy {:.3f}us, current {:.3f}us, {:.2f}x faster'.format(
+        args.calls, before * 1e6, after * 1e6, before / after))
+
+
+# A CPU-bound program with loops, function calls and a comprehension, to
+# measure the cost of counting the lines it runs
+LINES_PROGRAM = '''def is_prime(n):
+    if n < 2:
+        return False
+    i = 2
+    while i * i <= n:
+        if n % i == 0:
+            return False
+        i += 1
+    return True
+
+
+count = 0
+for n in range(int(input())):
+    if is_prime(n):
+        count += 1
+squares = [n * n for n in range(count)]
+print(count, sum(squares))
+'''
+
+
+def bench_lines(args):
+    """Time a CPU-bound program without counting lines, with the counter
+    automarker uses on this Python and with sys.settrace()
+    """
+    bytecode = compile(LINES_PROGRAM, 'lines.py', 'exec')
+    test_input = '{}\n'.format(args.calls)
+    counters = [('none', {}, True)]
+    if automarker.LINE_MONITORING:
+        counters.append(('sys.monitoring', {'count_lines': True}, True))
+    counters.append(('sys.settrace', {'count_lines': True}, False))
+    baseline = None
+    for name, kwargs, monitoring in counters:
+        with mock.patch('automarker.LINE_MONITORING', automarker.LINE_MONITORING and monitoring):
+            times = []
+            for _ in range(args.repeat):
+                executor = automarker.Executor('lines.py', bytecode, test_input, **kwargs)
+                elapsed, _ = timed(executor.execute)
+                times.append(elapsed)
+        best = min(times)
+        lines = executor.stats[3]
+        if baseline is None:
+            baseline = best
+            print('{:15} {:9.3f}ms'.format(name, best * 1e3))
+            continue
+        print('{:15} {:9.3f}ms, {:.2f}x as long, {} lines, {:.3f}us per line'.format(
+            name, best * 1e3, best / baseline, lines, (best - baseline) / lines * 1e6))
+
+
+
+# Programs that do the same sum in different ways, to check that the lines
+# counted for each, and so their ratios to the formula, are close on every
+# Python version. The one-line loops are the ones a count of line events
+# alone misses.
+COUNT_PROGRAMS = {
+    'formula': 'n = int(input())\nprint(n * (n - 1) // 2)\n',
+    'for': 'total = 0\nfor i in range(int(input())):\n    total += i\nprint(total)\n',
+    'while': 'n = int(input())\ni = total = 0\nwhile i < n:\n'
+             '    total += i\n    i += 1\nprint(total)\n',
+    'one-line for': 'total = 0\nfor i in range(int(input())): total += i\nprint(total)\n',
+    'one-line while': 'n = int(input())\ni = total = 0\n'
+                      'while i < n: total += i; i += 1\nprint(total)\n',
+    'comprehension': 'print(sum([i for i in range(int(input()))]))\n',
+    'function': 'def add(a, b):\n    return a + b\n\n\ntotal = 0\n'
+                'for i in range(int(input())):\n    total = add(total, i)\nprint(total)\n',
+}
+
+COUNT_SCRIPT = '''import json, sys
+sys.path.insert(0, sys.argv[1])
+import automarker
+counts = {}
+for name, program in json.loads(sys.argv[2]).items():
+    bytecode = compile(program, 'count.py', 'exec')
+    executor = automarker.Executor('count.py', bytecode, sys.argv[3] + '\\n', count_lines=True)
+    executor.execute()
+    counts[name] = executor.stats[3]
+print(json.dumps(counts))
+'''
+
+
+def bench_counts(args):
+    """Count the lines the programs in COUNT_PROGRAMS run on each Python
+    in --python and exit with an error if their ratios to the formula differ
+    by more than --tolerance between them
+    """
+    pythons = args.python or [sys.executable]
+    counts = {}
+    for python in pythons:
+        output = subprocess.check_output(
+            [python, '-c', COUNT_SCRIPT, HERE, json.dumps(COUNT_PROGRAMS), str(args.calls)],
+            universal_newlines=True)
+        counts[python] = json.loads(output)
+    versions = [subprocess.check_output(
+        [python, '-c', 'import platform; print(platform.python_version())'],
+        universal_newlines=True).strip() for python in pythons]
+    print('{:15} '.format('program') + ' '.join('{:>19}'.format(v) for v in versions)
+          + '  spread')
+    worst = 1
+    for name in COUNT_PROGRAMS:
+        ratios = [counts[python][name] / counts[python]['formula'] for python in pythons]
+        spread = max(ratios) / min(ratios)
+        worst = max(worst, spread)
+        print('{:15} '.format(name) + ' '.join(
+            '{:>9} {:>9.1f}'.format(counts[python][name], ratio)
+            for python, ratio in zip(pythons, ratios)) + '  {:.3f}x'.format(spread))
+    if worst > args.tolerance:
+        sys.exit('Ratios differ by up to {:.3f}x between Python versions'.format(worst))
+
+class LegacyTexttable(automarker.Texttable):
+    """Texttable that measures, wraps and draws cells as in automarker 0.2.2"""
+
+    def draw(self):
+        if not self._header and not self._rows:
+            return
+        self._compute_cols_width()
+        self._check_align()
+        out = ""
+        if self._has_border():
+            out += self._hline()
+        if self._header:
+            out += self._draw_line(self._header, isheader=True)
+            if self._has_header():
+                out += self._hline_header()
+        length = 0
+        for row in self._rows:
+            length += 1
+            out += self._draw_line(row)
+            if self._has_hlines() and length < len(self._rows):
+                out += self._hline()
+        if self._has_border():
+            out += self._hline()
+        return out[:-1]
+
+    def _draw_line(self, line, isheader=False):
+        line = self._splitit(line, isheader)
+        space = " "
+        out = ""
+        for i in range(len(line[0])):
+            if self._has_border():
+                out += "%s " % self._char_vert
+            length = 0
+            for cell, width, align in zip(line, self._width, self._align):
+                length += 1
+                cell_line = cell[i]
+                fill = width - len(cell_line)
+                if isheader:
+                    align = self._header_align[length - 1]
+                if align == "r":
+                    out += fill * space + cell_line
+                elif align == "c":
+                    out += (int(fill/2) * space + cell_line
+                            + int(fill/2 + fill % 2) * space)
+                else:
+                    out += cell_line + fill * space
+                if length < len(line):
+                    out += " %s " % [space,
+                                     self._char_vert][self._has_vlines()]
+            out += "%s\n" % ['', space + self._char_vert][self._has_border()]
+        return out
+
+    def _len_cell(self, cell):
+        cell_lines = cell.split('\n')
+        maxi = 0
+        for line in cell_lines:
+            length = 0
+            parts = line.split('\t')
+            for part, i in zip(parts, list(range(1, len(parts) + 1))):
+                length = length + len(part)
+                if i < len(parts):
+                    length = (length//8 + 1) * 8
+            maxi = max(maxi, length)
+        return maxi
+
+    def add_row(self, array):
+        self._check_row_size(array)
+        if not hasattr(self, "_dtype"):
+            self._dtype = ["a"] * self._row_size
+        self._rows.append([self._str(i, x) for i, x in enumerate(array)])
+        return self
+
+    def _compute_cols_width(self):
+        if hasattr(self, "_width"):
+            return
+        maxi = []
+        if self._header:
+            maxi = [self._len_cell(x) for x in self._header]
+        for row in self._rows:
+            for cell, i in zip(row, list(range(len(row)))):
+                try:
+                    maxi[i] = max(maxi[i], self._len_cell(cell))
+                except (TypeError, IndexError):
+                    maxi.append(self._len_cell(cell))
+        ncols = len(maxi)
+        content_width = sum(maxi)
+        deco_width = 3*(ncols-1) + [0, 4][self._has_border()]
+        if self._max_width and (content_width + deco_width) > self._max_width:
+            available_width = self._max_width - deco_width
+            newmaxi = [0] * ncols
+            i = 0
+            while available_width > 0:
+                if newmaxi[i] < maxi[i]:
+                    newmaxi[i] += 1
+                    available_width -= 1
+                i = (i + 1) % ncols
+            maxi = newmaxi
+        self._width = maxi
+
+    def _splitit(self, line, isheader):
+        line_wrapped = []
+        for cell, width in zip(line, self._width):
+            array = []
+            for c in cell.split('\n'):
+                if c.strip() == "":
+                    array.append("")
+                else:
+                    array.extend(automarker.tw.wrap(c, width))
+            line_wrapped.append(array)
+        max_cell_lines = max(map(len, line_wrapped))
+        for cell in line_wrapped:
+            cell.extend([""] * (max_cell_lines - len(cell)))
+        return line_wrapped
+
+
+def make_detail_table(table_class, rows):
+    """Build a report detail table with multi-line, wrapped cells
+
+    Like a real report, the inputs and expected outputs repeat while the
+    actual outputs differ from row to row.
+    """
+    table = table_class()
+    table.header(['Failed Test Case', 'Input', 'Expected Output', 'Actual Output'])
+    test_inputs = ['\n'.join('1, 0, 1, {}, 0, 1, 0, 0'.format(i) for _ in range(7))
+                   for i in range(6)]
+    expected = ['\n'.join('Day {}   {} egg(s)'.format(day, i) for day in range(1, 8))
+                for i in range(6)]
+    for i in range(rows):
+        actual = '\n'.join('Day {}   {} egg(s)'.format(day, i) for day in range(1, 6))
+        if i % 3 == 0:
+            actual = 'Traceback: ' + 'name \'day{}_eggs\' is not defined '.format(i) * 4
+        table.add_row([i + 1, test_inputs[i % 6], expected[i % 6], actual])
+    return table
+
+
+def bench_texttable(args):
+    with tempfile.TemporaryFile('w+') as f:
+        def draw(table_class):
+            make_detail_table(table_class, args.rows).draw_to(f)
+
+        def draw_legacy():
+            f.write(make_detail_table(LegacyTexttable, args.rows).draw() + '\n')
+
+        elapsed_legacy, _ = timed(draw_legacy)
+        f.seek(0)
+        output = f.read()
+        f.seek(0)
+        f.truncate()
+        elapsed_current, _ = timed(draw, automarker.Texttable)
+        f.seek(0)
+        if f.read() != output:
+            print('WARNING: output differs from the legacy renderer')
+        memory_legacy = peak_memory(draw_legacy)
+        memory_current = peak_memory(draw, automarker.Texttable)
+    print('Texttable with {} rows ({:.1f} MB) built and written to a file:'.format(
+        args.rows, len(output) / 2**20))
+    print('  automarker 0.2.2  {:.3f}s, peak {:7.2f} MB'.format(
+        elapsed_legacy, memory_legacy / 2**20))
+    print('  current           {:.3f}s, peak {:7.2f} MB ({:.2f}x faster)'.format(
+        elapsed_current, memory_current / 2**20, elapsed_legacy / elapsed_current))
+
+
+def bench_io(args):
+    calls = args.calls
+    programs = {
+        'print': 'for i in range({}):\n    print(i, "egg(s)", sep="  ")'.format(calls),
+        'input': 'for i in range({}):\n    input()'.format(calls),
+    }
+    test_input = '1, 0, 1, 1\n' * calls
+    for name, source in programs.items():
+        bytecode = compile(source, name + '.py', 'exec')
+        times = {}
+        for executor_class in (MockExecutor, automarker.Executor):
+            executor = executor_class(name + '.py', bytecode, test_input)
+            times[executor_class], _ = timed(executor.execute)
+        before, after = times[MockExecutor], times[automarker.Executor]
+        print('{:5} x {}: mock.patch {:7.3f}us/call, direct {:7.3f}us/call, '
+              '{:5.1f}x faster'.format(name, calls, before / calls * 1e6,
+                                       after / calls * 1e6, before / after))
+
+
+def bench_startup(args):
+    """Time cold starts of new interpreters running the headless automarker"""
+    automarker_py = path.join(HERE, 'automarker.py')
+    commands = {
+        'python (baseline)': [sys.executable, '-c', 'pass'],
+        'import automarker': [sys.executable, '-c', 'import automarker'],
+        'automarker.py --help': [sys.executable, automarker_py, '--help'],
+        'automarker.py test1': [sys.executable, automarker_py, '--no-cache',
+                                path.join(HERE, 'test1', 'test_cases.txt'),
+                                path.join(HERE, 'test1')],
+    }
+    for name, command in commands.items():
+        times = []
+        for _ in range(args.repeat):
+            elapsed, _ = timed(subprocess.run, command, cwd=HERE,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(elapsed)
+        print('{:22} best {:6.1f}ms, mean {:6.1f}ms'.format(
+            name, min(times) * 1e3, sum(times) / len(times) * 1e3))
+    loaded = subprocess.run(
+        [sys.executable, '-c', 'import sys, automarker; print("tkinter" in sys.modules)'],
+        cwd=HERE, stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+    print('tkinter imported by the headless path: ' + loaded)
+
+
+def make_submission_tree(folder, files):
+    """Create a tree of 20 files in each of files // 20 student folders, a
+    quarter of which match Q1_*.py, with folders dated an hour ago
+    """
+    old = time.time() - 3600
+    for i in range(files // 20):
+        student = path.join(folder, 'class{:02d}'.format(i % 40), 'student{:05d}'.format(i))
+        os.makedirs(student)
+        for j in range(20):
+            name = 'Q{}_{:05d}.py'.format(j % 4 + 1, i) if j < 16 else 'notes{}.txt'.format(j)
+            with open(path.join(student, name), 'w'):
+                pass
+        os.utime(student, (old, old))
+    for name in os.listdir(folder):
+        os.utime(path.join(folder, name), (old, old))
+    os.utime(folder, (old, old))
+
+
+def bench_search(args):
+    """Time searching a large tree of submissions with glob and with
+    find_files(), with and without a folder index
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        make_submission_tree(folder, args.files)
+        pattern = path.join(folder, '**', 'Q1_*.py')
+        results = {}
+        for name, fn in (
+                ('glob.glob', lambda: glob.glob(pattern, recursive=True)),
+                ('find_files', lambda: automarker.find_files(folder, 'Q1_*.py', True))):
+            elapsed, results[name] = timed(fn)
+            print('{:34} {:8.1f}ms'.format(name, elapsed * 1e3))
+        index = {}
+        elapsed, _ = timed(automarker.find_files, folder, 'Q1_*.py', True, index)
+        print('{:34} {:8.1f}ms'.format('find_files, building index', elapsed * 1e3))
+        elapsed, results['indexed'] = timed(
+            automarker.find_files, folder, 'Q1_*.py', True, index)
+        print('{:34} {:8.1f}ms'.format('find_files, unchanged index', elapsed * 1e3))
+        student = path.join(folder, 'class00', 'student00000')
+        with open(path.join(student, 'Q1_new.py'), 'w'):
+            pass
+        elapsed, changed = timed(automarker.find_files, folder, 'Q1_*.py', True, index)
+        print('{:34} {:8.1f}ms'.format('find_files, one folder changed', elapsed * 1e3))
+        print('{} files, {} matches, results match glob: {}, new file found: {}'.format(
+            args.files, len(results['glob.glob']),
+            all(sorted(files) == sorted(results['glob.glob']) for files in results.values()),
+            path.join(student, 'Q1_new.py') in changed))
+
+
+# Programs of a synthetic cohort for a problem that adds two integers. Each
+# program is made unique by a comment so that none are deduplicated.
+SYNTHETIC_PROGRAMS = {
+    'pass': 'a = int(input())\nb = int(input())\nprint(a + b)\n',
+    'fail': 'a = int(input())\nb = int(input())\nprint(a - b)\n',
+    'crash': 'a = int(input())\nb = int("b")\nprint(a + b)\n',
+    'syntax': 'a = int(input())\nb = int(input())\nprint(a +\n',
+    'print': 'a = int(input())\nb = int(input())\nfor i in range(2000):\n'
+             '    print("working", i)\nprint(a + b)\n',
+}
+
+
+def parse_mix(mix):
+    """Parse a mix like pass=60,fail=20 into a dict of weights"""
+    weights = {}
+    for item in mix.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in SYNTHETIC_PROGRAMS:
+            raise argparse.ArgumentTypeError('unknown program kind: ' + kind)
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def make_synthetic_cohort(folder, submissions, test_cases, mix, seed=0):
+    """Write a test cases file and submissions in student subfolders,
+    choosing each submission's kind from the weights in mix, and return the
+    test cases file name and the number of each kind
+    """
+    rng = random.Random(seed)
+    test_cases_file = path.join(folder, 'test_cases.txt')
+    with open(test_cases_file, 'w') as f:
+        for i in range(test_cases):
+            a, b = rng.randint(-1000, 1000), rng.randint(-1000, 1000)
+            f.write('### Test Case {0}: Input\n{1}\n{2}\n'
+                    '### Test Case {0}: Output\n{3}\n'.format(i + 1, a, b, a + b))
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=submissions)
+    for i, kind in enumerate(kinds):
+        student = path.join(folder, 'submissions', 'student{:05d}'.format(i))
+        os.makedirs(student)
+        with open(path.join(student, 'Q1.py'), 'w') as f:
+            f.write('# Student {} ({})\n'.format(i, kind) + SYNTHETIC_PROGRAMS[kind])
+    return test_cases_file, {kind: kinds.count(kind) for kind in mix}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(args):
+    """Time each stage of marking a synthetic cohort and optionally save the
+    timings as JSON to compare across commits
+    """
+    mix = parse_mix(args.mix)
+    stages = {}
+
+    def stage(name, fn, *fn_args):
+        times = []
+        for _ in range(args.rounds):
+            elapsed, result = timed(fn, *fn_args)
+            times.append(elapsed)
+        stages[name] = {'best': min(times), 'mean': sum(times) / len(times)}
+        print('{:10} best {:9.3f}ms, mean {:9.3f}ms'.format(
+            name, min(times) * 1e3, sum(times) / len(times) * 1e3))
+        return result
+
+    with tempfile.TemporaryDirectory() as folder:
+        test_cases_file, kinds = make_synthetic_cohort(
+            folder, args.submissions, args.test_cases, mix, args.seed)
+        submissions = path.join(folder, 'submissions')
+        print('{} submission(s) x {} test case(s): {}'.format(
+            args.submissions, args.test_cases,
+            ', '.join('{} {}'.format(count, kind) for kind, count in kinds.items())))
+        app = automarker.AutoMarker()
+        app.set_cache_folder(None)
+        app.set_workers(args.workers)
+        app.set_subfolders(True)
+
+        def search():
+            app.set_folder(submissions)
+            return app.files
+
+        def parse():
+            app.set_test_cases_file(test_cases_file)
+            return app.test_cases
+
+        def compile_all():
+            tester = automarker.Tester(app.test_cases)
+            compiled = []
+            for filename in files:
+                try:
+                    compiled.append((filename, tester.compile(filename)[0]))
+                except SyntaxError:
+                    pass
+            return compiled
+
+        def execute_all():
+            results = []
+            for filename, bytecode in compiled:
+                test_results = []
+                for test_case in test_cases:
+                    executor = automarker.Executor(filename, bytecode, test_case.test_input)
+                    try:
+                        output = executor.execute()
+                    except Exception as e:
+                        output = str(e)
+                    test_results.append(automarker.TestResult(
+                        test_case, output.rstrip() == test_case.expected_output.rstrip(),
+                        output))
+                results.append(automarker.SubmissionResult(filename, test_results))
+            return results
+
+        def render():
+            f = io.StringIO()
+            app.generate_report(f, results=results)
+            return f.getvalue()
+
+        def generate_report():
+            f = io.StringIO()
+            app.generate_report(f)
+            return f.getvalue()
+
+        files = stage('search', search)
+        test_cases = stage('parse', parse)
+        compiled = stage('compile', compile_all)
+        results = stage('execute', execute_all)
+        stage('render', render)
+        stage('report', generate_report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'python': sys.version,
+                'cpus': os.cpu_count(),
+                'parameters': {
+                    'submissions': args.submissions,
+                    'test_cases': args.test_cases,
+                    'mix': mix,
+                    'seed': args.seed,
+                    'workers': args.workers,
+                    'rounds': args.rounds,
+                },
+                'stages': stages,
+            }, f, indent=2)
+            f.write('\n')
+
+
+def bench_recycle(args):
+    """Run submissions in a Sandbox that is replaced after every
+    --recycle-after submissions and check how many child processes ran them
+    """
+    bytecode = compile('import os\nprint(os.getpid())\n', 'pid.py', 'exec')
+    sandbox = automarker.Sandbox(automarker.DEFAULT_TIMEOUT, recycle_after=args.recycle_after)
+    pids = []
+    try:
+        elapsed, _ = timed(lambda: [
+            pids.append(sandbox.run('submission{}.py'.format(i), bytecode, ''))
+            for i in range(args.submissions) for _ in range(args.test_cases)])
+    finally:
+        sandbox.close()
+    children = len(set(pids))
+    expected = -(-args.submissions // args.recycle_after)
+    print('{} submission(s) x {} test case(s), recycling after {}: {} child process(es) '
+          'in {:.3f}s'.format(args.submissions, args.test_cases, args.recycle_after,
+                              children, elapsed))
+    # Each child must run exactly recycle_after consecutive submissions
+    runs = [pids[i] for i in range(0, len(pids), args.test_cases)]
+    if children != expected or any(runs[i] != runs[i - i % args.recycle_after]
+                                   for i in range(len(runs))):
+        sys.exit('Expected {} child process(es), each running {} submission(s)'.format(
+            expected, args.recycle_after))
+
+
+BENCHMARKS = {
+    'parallel': bench_parallel,
+    'io': bench_io,
+    'executor': bench_executor,
+    'texttable': bench_texttable,
+    'startup': bench_startup,
+    'search': bench_search,
+    'suite': bench_suite,
+    'lines': bench_lines,
+    'counts': bench_counts,
+    'recycle': bench_recycle,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run automarker benchmarks.')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--copies', type=int, default=100,
+                        help='number of copies of the test2 students (default: 100)')
+    parser.add_argument('--workers', type=int, default=automarker.DEFAULT_WORKERS,
+                        help='largest number of worker processes to try')
+    parser.add_argument('--calls', type=int, default=100000,
+                        help='number of input()/print() calls or Executor() '
+                             'constructions, numbers checked by the lines benchmark or '
+                             'numbers summed by the counts benchmark (default: 100000)')
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='number of rows in the rendered table (default: 10000)')
+    parser.add_argument('--submissions', type=int, default=200,
+                        help='number of submissions in the synthetic cohort (default: 200)')
+    parser.add_argument('--test-cases', type=int, default=10,
+                        help='number of test cases in the synthetic cohort (default: 10)')
+    parser.add_argument('--mix', default='pass=50,fail=20,crash=10,syntax=10,print=10',
+                        help='weights of each kind of program in the synthetic cohort '
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the synthetic cohort (default: 0)')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='number of times to time each stage of the suite (default: 3)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='save the timings of the suite to this file')
+    parser.add_argument('--recycle-after', type=int, default=10,
+                        help='number of submissions each Sandbox child runs in the '
+                             'recycle benchmark (default: 10)')
+    parser.add_argument('--files', type=int, default=50000,
+                        help='number of files in the searched tree (default: 50000)')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='number of times to repeat each cold start or lines '
+                             'benchmark run (default: 10)')
+    parser.add_argument('--python', action='append', metavar='EXECUTABLE',
+                        help='Python to count lines with in the counts benchmark; may be '
+                             'given more than once (default: this Python)')
+    parser.add_argument('--tolerance', type=float, default=1.05,
+                        help='largest spread of the ratios to the formula allowed between '
+                             'Pythons in the counts benchmark (default: %(default)s)')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()